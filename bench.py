@@ -0,0 +1,141 @@
+# замер времени кадров на уровнях без окна и звука: python bench.py [--save b.json]
+# [--baseline b.json] [уровни], по умолчанию все levels/lev_*.txt
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame  # noqa: E402
+import main  # noqa: E402
+
+# части кадра в том порядке, в котором их выполняет LevelScene
+SECTIONS = ('events', 'physics', 'camera', 'draw', 'hud')
+PERCENTILES = (50, 95, 99)
+JUMP_EVERY = 9  # прыжок каждые столько кадров, как в регрессионном прогоне headless.py
+
+
+# перцентиль по ближайшему рангу, times отсортированы
+def percentile(times, p):
+    return times[max(0, -(-len(times) * p // 100) - 1)]
+
+
+def summary(times):
+    times = sorted(times)
+    res = {f'p{p}': round(percentile(times, p), 4) for p in PERCENTILES}
+    res['max'] = round(times[-1], 4)
+    return res
+
+
+# прогон уровня на frames кадров, в каждом кадре ровно один шаг физики; при смерти или победе
+# уровень перезапускается на месте, jumps - номера шагов от начала попытки с нажатием
+def bench_level(level_name, frames, warmup, jumps):
+    main.tile_images['wall'] = main.image_cache.get(main.blocks[main.set_for_playing], (100, 100))
+    level = main.Level(level_name)
+    player = level.player
+    layers = main.BAKED_LAYERS if main.static_layer.chunks else main.LEVEL_LAYERS
+    layers = tuple(layer for layer in layers if layer != 'hud')
+    click = pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=(0, 0))
+    times = {section: [] for section in SECTIONS + ('frame',)}
+    restarts = 0
+    step = 0
+    clock = time.perf_counter
+    for frame in range(frames + warmup):
+        if step in jumps:
+            pygame.event.post(click)
+        start = clock()
+        for event in pygame.event.get():
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                player.jump()
+        t_events = clock()
+        status = main.step_level(player)
+        step += 1
+        t_physics = clock()
+        level.camera.update(player.rect)
+        if level.stream is not None:
+            level.stream.update(level.camera)
+        t_camera = clock()
+        main.screen.fill(pygame.Color((60, 107, 214)))
+        main.render_level(level.camera, player, player.rect, 0, layers)
+        t_draw = clock()
+        main.draw_hud(player, 0)
+        pygame.display.flip()
+        end = clock()
+        if frame >= warmup:
+            for section, begin, stop in zip(SECTIONS + ('frame',),
+                                            (start, t_events, t_physics, t_camera, t_draw, start),
+                                            (t_events, t_physics, t_camera, t_draw, end, end)):
+                times[section].append((stop - begin) * 1000)
+        if status is not None:
+            level.reset()
+            player = level.player
+            restarts += 1
+            step = 0
+    main.clear_level()
+    res = {'frames': frames, 'restarts': restarts}
+    res.update((section, summary(values)) for section, values in times.items())
+    return res
+
+
+def run(level_names, frames, warmup, jumps):
+    return {'frames': frames, 'warmup': warmup,
+            'levels': {name: bench_level(name, frames, warmup, jumps) for name in level_names}}
+
+
+# сравнение с сохраненным прогоном: строки (уровень, часть кадра, перцентиль, было, стало,
+# отношение, регрессия); регрессией считается рост перцентилей всего кадра больше threshold,
+# части кадра и max слишком шумные и выводятся для справки
+def compare(result, baseline, threshold):
+    rows = []
+    for name, level in result['levels'].items():
+        if name not in baseline['levels']:
+            continue
+        old_level = baseline['levels'][name]
+        for section in ('frame',) + SECTIONS:
+            for key in ('p50', 'p95', 'p99', 'max'):
+                old, new = old_level[section][key], level[section][key]
+                ratio = new / old if old else 1
+                worse = section == 'frame' and key != 'max' and ratio > threshold
+                rows.append((name, section, key, old, new, ratio, worse))
+    return rows
+
+
+def print_comparison(rows):
+    print(f'{"level":<14}{"section":<9}{"stat":<6}{"base ms":>10}{"now ms":>10}{"ratio":>8}')
+    for name, section, key, old, new, ratio, worse in rows:
+        mark = '  <- regression' if worse else ''
+        print(f'{name:<14}{section:<9}{key:<6}{old:>10.3f}{new:>10.3f}{ratio:>8.2f}{mark}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='frame time benchmark over the levels')
+    parser.add_argument('levels', nargs='*', help='level files, default levels/lev_*.txt')
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--jumps', help='frames with a jump, comma separated '
+                                        f'(default every {JUMP_EVERY} frames)')
+    parser.add_argument('--save', help='write the result as JSON to this file')
+    parser.add_argument('--baseline', help='compare with a result saved by --save')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio counted as a regression (default 1.2)')
+    args = parser.parse_args()
+    names = args.levels or sorted(os.path.basename(path)
+                                  for path in glob.glob(os.path.join('levels', 'lev_*.txt')))
+    if args.jumps:
+        jumps = {int(step) for step in args.jumps.split(',') if step}
+    else:
+        jumps = set(range(1, args.frames + args.warmup, JUMP_EVERY))
+    result = run(names, args.frames, args.warmup, jumps)
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(result, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            rows = compare(result, json.load(baseline_file), args.threshold)
+        print_comparison(rows)
+        sys.exit(any(row[-1] for row in rows))
+    print(json.dumps(result, indent=2))
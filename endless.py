@@ -0,0 +1,126 @@
+# бесконечный режим: столбцы уровня генерируются по зерну по мере того, как игрок бежит вперед
+# столбцы в том же алфавите, что и levels/*.txt: . # ^ v 0 @
+import random
+from collections import deque
+
+HEIGHT = 6  # высота уровня в клетках, как у обычных уровней
+FLOOR = HEIGHT - 1  # строка пола
+GROUND = FLOOR - 1  # строка, по которой бежит игрок
+TILE = 100
+RAMP_COLUMNS = 400  # через столько столбцов сложность становится максимальной
+START_RUN = 8  # ровный участок в начале, игрок появляется во втором столбце
+
+
+# прыжок по шагам физики: высота низа игрока над точкой прыжка после каждого шага,
+# пока он не вернется на ту же высоту
+def jump_arc(jump_speed, gravity):
+    heights = []
+    height, s_y = 0, -jump_speed
+    while True:
+        height -= s_y
+        s_y += gravity
+        if height <= 0:
+            return heights
+        heights.append(height)
+
+
+# самое широкое препятствие высотой height, над которым игрок точно перепрыгнет:
+# в шаг перед отрывом от высоты height и в шаг после возвращения на нее прямоугольник
+# игрока не должен задевать препятствие
+def clear_width(arc, height, speed_x, player_width):
+    steps = [i for i, h in enumerate(arc, 1) if h >= height]
+    if not steps:
+        return 0
+    return (steps[-1] - steps[0] + 2) * speed_x - player_width
+
+
+# класс бесконечного уровня, у него нет ширины, а столбцы нужно брать по порядку
+class EndlessLevel:
+    width = None
+    height = HEIGHT
+
+    def __init__(self, seed, jump_speed, jump_speed_x, gravity, player_size):
+        self.seed = seed
+        self.random = random.Random(seed)
+        arc = jump_arc(jump_speed, gravity)
+        player_width, player_height = player_size
+        # ширины препятствий в клетках, ям в полу и шипов на полу
+        self.max_pit = max(1, clear_width(arc, 1, jump_speed_x, player_width) // TILE)
+        self.max_spikes = max(1, clear_width(arc, TILE, jump_speed_x, player_width) // TILE)
+        # на ступеньку в одну клетку можно запрыгнуть, только если прыжок выше клетки
+        self.can_step = max(arc) > TILE
+        # после прыжка игрок приземляется не дальше, чем через столько клеток
+        self.min_run = -(-(len(arc) * jump_speed_x + player_width) // TILE)
+        self.coin_row = GROUND - (max(arc) + TILE - player_height) // TILE
+        self.pending = deque()  # сгенерированные, но еще не взятые столбцы
+        self.first = 0  # номер столбца pending[0]
+        self.generated = 0
+        self.segment(START_RUN, spawn=True)
+
+    # столбец x сверху вниз строкой, уже взятые столбцы не хранятся
+    def column(self, x):
+        if x < self.first:
+            raise IndexError(f'column {x} of the endless level was already dropped')
+        while self.first + len(self.pending) <= x:
+            self.next_segment()
+        while self.first < x:
+            self.pending.popleft()
+            self.first += 1
+        return self.pending[0]
+
+    # сложность от 0 до 1 в зависимости от пройденного расстояния
+    def difficulty(self):
+        return min(1, self.generated / RAMP_COLUMNS)
+
+    def add(self, cells):
+        self.pending.append(''.join(cells))
+        self.generated += 1
+
+    # ровный участок длиной length, иногда с монетками
+    def segment(self, length, spawn=False):
+        coins = self.random.random() < 0.3
+        for i in range(length):
+            cells = ['.'] * HEIGHT
+            cells[FLOOR] = '#'
+            if spawn and i == 1:
+                cells[GROUND] = '@'
+            elif coins and i % 2:
+                cells[GROUND] = '0'
+            self.add(cells)
+
+    # одно препятствие и ровный участок после него, чем дальше, тем они короче и чаще
+    def next_segment(self):
+        d = self.difficulty()
+        rand = self.random
+        kinds = ['pit', 'spikes', 'tunnel'] + (['step'] if self.can_step else [])
+        kind = rand.choice(kinds)
+        if kind == 'pit':
+            # яма с шипами на месте пола
+            for i in range(rand.randint(1, 1 + round(d * (self.max_pit - 1)))):
+                cells = ['.'] * HEIGHT
+                cells[FLOOR] = '^'
+                cells[self.coin_row] = '0' if i == 0 and rand.random() < 0.5 else '.'
+                self.add(cells)
+        elif kind == 'spikes':
+            for i in range(rand.randint(1, 1 + round(d * (self.max_spikes - 1)))):
+                cells = ['.'] * HEIGHT
+                cells[FLOOR] = '#'
+                cells[GROUND] = '^'
+                cells[self.coin_row] = '0' if i == 0 and rand.random() < 0.5 else '.'
+                self.add(cells)
+        elif kind == 'step':
+            # ступенька вверх на одну клетку, с нее игрок просто сбегает
+            for i in range(rand.randint(2, 5)):
+                cells = ['.'] * HEIGHT
+                cells[FLOOR] = cells[GROUND] = '#'
+                cells[GROUND - 1] = '0' if rand.random() < 0.3 else '.'
+                self.add(cells)
+        else:
+            # шипы на потолке над полом: здесь прыгать нельзя
+            for i in range(rand.randint(2, 2 + round(d * 4))):
+                cells = ['.'] * HEIGHT
+                cells[FLOOR] = '#'
+                cells[GROUND - 1] = 'v'
+                self.add(cells)
+        run = self.min_run + round((1 - d) * 4)
+        self.segment(rand.randint(run, run + 2))
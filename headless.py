@@ -0,0 +1,133 @@
+# прогон уровней без окна и звука: для проверки уровней и регрессионных тестов
+import os
+import sys
+import json
+import time
+from collections import namedtuple
+
+# окно и звук не нужны, драйверы-заглушки надо выбрать до инициализации pygame'a
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import main  # noqa: E402
+import replay  # noqa: E402
+
+# снимок симуляции, collected - номера уже собранных монеток
+State = namedtuple('State', ['steps', 'status', 'coin_count', 'coin_frame', 'rect', 's_x', 's_y',
+                             'jump_p', 'count', 'cur_frame', 'cur_jump_frame', 'image', 'mask',
+                             'coins_count', 'score', 'collected'])
+
+
+# класс симуляции одного уровня, шаги физики те же, что в LevelScene; бесконечный уровень
+# подгружается столбцами вокруг игрока, как в окне, и у него нет snapshot и restore
+class Simulation:
+    def __init__(self, level_name, skin='Standard', cheated=False):
+        self.level_name = level_name
+        main.clear_level()
+        data = main.load_level(level_name)
+        self.stream = None
+        if data.width is None:
+            self.stream = main.LevelStream(data, bake=False, skin=skin, with_coins=cheated)
+            self.camera = main.Camera((None, data.height - 1))
+            self.player = self.stream.start(self.camera)
+            self.columns = None
+        else:
+            self.player, level_x, level_y = main.generate_level(
+                data, bake=False, skin=skin, with_coins=cheated)
+            self.columns = level_x + 1
+        self.coins = list(main.coins)
+        self.steps = 0
+        self.status = None
+
+    # один шаг физики, jump - был ли нажат прыжок перед этим шагом
+    def step(self, jump=False):
+        if jump:
+            self.player.jump()
+        self.status = main.step_level(self.player)
+        self.steps += 1
+        if self.stream is not None:
+            self.camera.update(self.player.rect)
+            self.stream.update(self.camera)
+        return self.status
+
+    # прогон с прыжками на шагах из jumps, пока игрок не выиграет, не разобьется
+    # или не кончатся max_steps
+    def run(self, jumps=(), max_steps=None):
+        jumps = set(jumps)
+        if max_steps is None:
+            if self.columns is None:
+                raise ValueError('max_steps is required for an endless level')
+            max_steps = self.columns * main.tile_width // 5
+        while self.status is None and self.steps < max_steps:
+            self.step(self.steps in jumps)
+        return self.result()
+
+    # состояние симуляции, к которому можно вернуться через restore
+    def snapshot(self):
+        p = self.player
+        collected = frozenset(i for i, coin in enumerate(self.coins) if not coin.alive())
+        return State(self.steps, self.status, main.Coin.count, main.Coin.cur_frame,
+                     p.rect, p.s_x, p.s_y, p.jump_p, p.count, p.cur_frame, p.cur_jump_frame,
+                     p.image, p.mask, p.coins_count, p.score, collected)
+
+    def restore(self, state):
+        p = self.player
+        (self.steps, self.status, main.Coin.count, main.Coin.cur_frame,
+         p.rect, p.s_x, p.s_y, p.jump_p, p.count, p.cur_frame, p.cur_jump_frame,
+         p.image, p.mask, p.coins_count, p.score, collected) = state
+        p.prev_rect = p.rect
+        for i, coin in enumerate(self.coins):
+            if coin.alive() and i in collected:
+                main.grid.remove(coin, 'coins')
+                coin.kill()
+            elif not coin.alive() and i not in collected:
+                coin.add(main.all_sprites, main.coins)
+                main.grid.add(coin, 'coins')
+
+    # все, что влияет на дальнейшую физику, без номера шага
+    def key(self):
+        p = self.player
+        return (p.rect.x, p.rect.y, p.s_x, p.s_y, p.jump_p, p.cur_frame, p.cur_jump_frame,
+                id(p.image))
+
+    def result(self):
+        return {'level': self.level_name,
+                'outcome': self.status or 'timeout',
+                'steps': self.steps,
+                'x': self.player.rect.x,
+                'y': self.player.rect.y,
+                'coins': self.player.coins_count,
+                'score': self.player.score}
+
+
+# прогон уровня со списком шагов, на которых нажат прыжок
+def simulate(level_name, jumps=(), skin='Standard', cheated=False, max_steps=None):
+    return Simulation(level_name, skin, cheated).run(jumps, max_steps)
+
+
+# прогон записи попытки, matches - совпал ли исход с записанным
+def play_replay(path):
+    playback = replay.load(path)
+    res = simulate(playback.level_name, playback.jumps, playback.skin, playback.cheated,
+                   playback.steps)
+    res['matches'] = (res['outcome'] == (playback.outcome or 'timeout') and
+                      res['steps'] == playback.steps)
+    return res
+
+
+# запуск: python headless.py lev_1.txt [шаги прыжков через запятую]
+# или python headless.py replays/<запись>.rpl
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python headless.py <level> [jump steps, e.g. 10,35,80]\n'
+              '       python headless.py <replay.rpl>')
+        sys.exit(1)
+    steps = [int(step) for step in sys.argv[2].split(',') if step] if len(sys.argv) > 2 else []
+    start = time.perf_counter()
+    if sys.argv[1].endswith('.rpl'):
+        res = play_replay(sys.argv[1])
+    else:
+        res = simulate(sys.argv[1], steps)
+    elapsed = time.perf_counter() - start
+    res['steps_per_second'] = round(res['steps'] / elapsed) if elapsed else None
+    print(json.dumps(res, ensure_ascii=False))
@@ -0,0 +1,78 @@
+# замеры по кадрам: именованные таймеры и счетчики, в которые отчитываются части игры,
+# пока замеры включены; выключенный Profiler почти ничего не стоит
+import csv
+import time
+from collections import deque
+
+
+# класс замеров: текущий кадр копится в timers и counters, законченные кадры лежат в history,
+# а во время записи трассы еще и в trace
+class Profiler:
+    def __init__(self, history=120):
+        self.enabled = False
+        self.timers = {}  # имя -> миллисекунды за текущий кадр
+        self.counters = {}  # имя -> количество за текущий кадр
+        self.started = {}
+        self.history = deque(maxlen=history)
+        self.trace = None  # список кадров, пока пишется трасса
+        self.frame_number = 0
+
+    def start(self, name):
+        if self.enabled:
+            self.started[name] = time.perf_counter()
+
+    def stop(self, name):
+        if self.enabled and name in self.started:
+            elapsed = (time.perf_counter() - self.started.pop(name)) * 1000
+            self.timers[name] = self.timers.get(name, 0) + elapsed
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # значение, которое не копится, а просто запоминается, например размер группы
+    def set(self, name, value):
+        if self.enabled:
+            self.counters[name] = value
+
+    # закрываем кадр: frame_ms - сколько он длился вместе с ожиданием
+    def end_frame(self, frame_ms):
+        if not self.enabled:
+            return
+        self.frame_number += 1
+        frame = {'frame': self.frame_number, 'frame_ms': frame_ms}
+        frame.update((name, round(ms, 4)) for name, ms in self.timers.items())
+        frame.update(self.counters)
+        self.history.append(frame)
+        if self.trace is not None:
+            self.trace.append(frame)
+        self.timers = {}
+        self.counters = {}
+        self.started.clear()
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        if not self.enabled:
+            self.history.clear()
+            self.timers = {}
+            self.counters = {}
+            self.started.clear()
+
+    @property
+    def tracing(self):
+        return self.trace is not None
+
+    def start_trace(self):
+        self.trace = []
+
+    # пишем трассу в csv, столбцы - все имена, встретившиеся хоть в одном кадре
+    def stop_trace(self, path):
+        frames, self.trace = self.trace, None
+        names = []
+        for frame in frames:
+            names.extend(name for name in frame if name not in names)
+        with open(path, 'w', newline='') as out:
+            writer = csv.DictWriter(out, names, restval=0)
+            writer.writeheader()
+            writer.writerows(frames)
+        return len(frames)
@@ -0,0 +1,148 @@
+# скомпилированный формат уровней: сетка клеток и готовые списки объектов
+# исходником остаются levels/*.txt, а python level_format.py собирает из них compiled_levels/*.lvl
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+LEVELS_DIR = 'levels'
+COMPILED_DIR = 'compiled_levels'
+MAGIC = b'GLV1'
+# магия, ширина, высота, точка появления, количество порталов, шипов '^', шипов 'v',
+# монеток и отрезков стен
+HEADER = struct.Struct('<4sHHhhIIIII')
+
+
+# класс данных уровня
+class LevelData:
+    def __init__(self, width, height, cells, spawn=None, portals=(), spikes=(), up_spikes=(),
+                 coins=(), wall_spans=()):
+        self.width = width
+        self.height = height
+        self.cells = cells  # байты клеток по строкам, width * height штук
+        self.spawn = spawn  # (x, y) клетки '@' или None
+        self.portals = portals  # клетки '$'
+        self.spikes = spikes  # клетки '^'
+        self.up_spikes = up_spikes  # клетки 'v'
+        self.coins = coins  # клетки '0'
+        self.wall_spans = wall_spans  # (строка, первый столбец, последний столбец) подряд идущих '#'
+
+    # столбец уровня сверху вниз строкой
+    def column(self, x):
+        return self.cells[x::self.width].decode('ascii')
+
+    # клетки, в которые в чит-режиме кладутся монетки
+    def empty_cells(self):
+        empty = ord('.')
+        width = self.width
+        return [(i % width, i // width) for i, char in enumerate(self.cells) if char == empty]
+
+
+# разбор строк текстового уровня, строки дополняются точками до одной длины
+def parse_rows(rows):
+    width = max(map(len, rows))
+    rows = [line.ljust(width, '.') for line in rows]
+    spawn = None
+    portals, spikes, up_spikes, coins, wall_spans = [], [], [], [], []
+    for y, line in enumerate(rows):
+        start = None
+        for x, char in enumerate(line + '.'):
+            if char == '#':
+                if start is None:
+                    start = x
+                continue
+            if start is not None:
+                wall_spans.append((y, start, x - 1))
+                start = None
+            if char == '@':
+                spawn = (x, y)
+            elif char == '$':
+                portals.append((x, y))
+            elif char == '^':
+                spikes.append((x, y))
+            elif char == 'v':
+                up_spikes.append((x, y))
+            elif char == '0':
+                coins.append((x, y))
+    cells = ''.join(rows).encode('ascii', 'replace')
+    return LevelData(width, len(rows), cells, spawn, portals, spikes, up_spikes, coins, wall_spans)
+
+
+def read_text(path):
+    with open(path, 'r') as map_file:
+        return parse_rows([line.strip() for line in map_file])
+
+
+def _pack(items):
+    data = array('H', [value for item in items for value in item])
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _unpack(buffer, offset, count, size):
+    data = array('H')
+    data.frombytes(buffer[offset:offset + count * size * 2])
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return list(zip(*[iter(data)] * size)), offset + count * size * 2
+
+
+def write_compiled(level, path):
+    spawn = level.spawn or (-1, -1)
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, level.width, level.height, spawn[0], spawn[1],
+                              len(level.portals), len(level.spikes), len(level.up_spikes),
+                              len(level.coins), len(level.wall_spans)))
+        out.write(level.cells)
+        for items in (level.portals, level.spikes, level.up_spikes, level.coins):
+            out.write(_pack(items))
+        out.write(_pack(level.wall_spans))
+
+
+# чтение через mmap: сетка и списки копируются целиком, без разбора по символам
+def read_compiled(path):
+    with open(path, 'rb') as level_file:
+        with mmap.mmap(level_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            (magic, width, height, spawn_x, spawn_y, n_portals, n_spikes, n_up_spikes,
+             n_coins, n_spans) = HEADER.unpack_from(buffer)
+            if magic != MAGIC:
+                raise ValueError(f'{path}: not a compiled level')
+            offset = HEADER.size
+            cells = buffer[offset:offset + width * height]
+            offset += width * height
+            portals, offset = _unpack(buffer, offset, n_portals, 2)
+            spikes, offset = _unpack(buffer, offset, n_spikes, 2)
+            up_spikes, offset = _unpack(buffer, offset, n_up_spikes, 2)
+            coins, offset = _unpack(buffer, offset, n_coins, 2)
+            wall_spans, offset = _unpack(buffer, offset, n_spans, 3)
+    spawn = (spawn_x, spawn_y) if spawn_x >= 0 else None
+    return LevelData(width, height, cells, spawn, portals, spikes, up_spikes, coins, wall_spans)
+
+
+def compiled_path(filename):
+    return os.path.join(COMPILED_DIR, os.path.splitext(filename)[0] + '.lvl')
+
+
+# загрузка уровня: скомпилированный, если он не старше текстового, иначе текстовый
+def load(filename):
+    source = os.path.join(LEVELS_DIR, filename)
+    compiled = compiled_path(filename)
+    if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(source):
+        return read_compiled(compiled)
+    return read_text(source)
+
+
+# сборка всех уровней из levels/ в compiled_levels/
+def build(names=None):
+    os.makedirs(COMPILED_DIR, exist_ok=True)
+    names = names or sorted(name for name in os.listdir(LEVELS_DIR) if name.endswith('.txt'))
+    for name in names:
+        level = read_text(os.path.join(LEVELS_DIR, name))
+        write_compiled(level, compiled_path(name))
+        print(f'{name} -> {compiled_path(name)} ({level.width}x{level.height})')
+
+
+if __name__ == '__main__':
+    build(sys.argv[1:])
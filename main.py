@@ -3,21 +3,42 @@ import os
 import sys
 import pygame
 import random
-import sqlite3
+import time
+from array import array
+from collections import OrderedDict
+import level_format
+import endless
+import instrument
+import replay
+import skin_atlas
+import storage
 
 # инициализация pygame'a
 pygame.init()
 
 # объявление констант
-FPS = 50
+FPS = 50  # частота шагов физики, от нее зависят скорость игры и очки
+STEP_MS = 1000 / FPS
+RENDER_FPS = 60  # ограничение частоты отрисовки уровня, 0 - без ограничения
+MAX_STEPS_PER_FRAME = 5  # чтобы после долгого кадра не догонять физику бесконечно
+INTERPOLATE = True  # рисовать игрока между двумя последними шагами физики
 WIDTH = 800
 HEIGHT = 600
 SCREEN_RECT = (0, 0, WIDTH, HEIGHT)
 GRAVITY = 2
-con = sqlite3.connect('db.db')
-cur = con.cursor()
-result = cur.execute("""Select coins from coins""").fetchall()
-COINS = result[0][0]
+JUMP_SPEED = 29  # начальная скорость прыжка вверх
+JUMP_SPEED_X = 8  # скорость вперед во время прыжка
+PLAYER_SIZE = (70, 80)
+BAKE_STATIC = True  # рисовать неподвижные блоки заранее, кусками по CHUNK_COLUMNS столбцов
+CHUNK_COLUMNS = 8
+CHUNK_COLOR_KEY = (255, 0, 255)
+STREAM_LEVELS = True  # создавать спрайты только для столбцов рядом с камерой
+STREAM_AHEAD = 3  # сколько столбцов держать за правым краем экрана
+STREAM_BEHIND = 2  # и за левым
+ENDLESS_PREFIX = 'endless_'  # имя бесконечного уровня: endless_<зерно>
+SHOW_GHOST = True  # показывать на уровне полупрозрачного гуся, повторяющего лучший забег
+GHOST_ALPHA = 110
+db = storage.Storage('db.db')  # монетки, наборы и статистика в памяти, запись в фоне
 sound_count = 2
 blocks = {'Standard': 'block.jpg', 'Farmer': 'block3.png', 'Mario': 'block2.png'}
 set_for_playing = 'Standard'
@@ -43,11 +64,98 @@ def load_image(name, color_key=-1):
     return image
 
 
+# класс кэша изображений, хранит уже сконвертированные и отмасштабированные картинки
+class ImageCache:
+    def __init__(self, budget=64 * 1024 * 1024):
+        self.budget = budget  # лимит памяти в байтах
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.images = OrderedDict()
+
+    # получение картинки по ключу (имя, размер, цветовой ключ)
+    def get(self, name, size=None, color_key=-1):
+        key = (name, size, color_key)
+        image = self.images.get(key)
+        if image is not None:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return image
+        self.misses += 1
+        if size is None:
+            image = load_image(name, color_key)
+        else:
+            image = pygame.transform.scale(self.get(name, None, color_key), size)
+        self.images[key] = image
+        self.used += image.get_pitch() * image.get_height()
+        self.evict()
+        return image
+
+    # выкидываем давно не использованные картинки, пока не влезем в лимит
+    def evict(self):
+        while self.used > self.budget and len(self.images) > 1:
+            _, image = self.images.popitem(last=False)
+            self.used -= image.get_pitch() * image.get_height()
+
+    # заранее загружаем картинки, items - имена или кортежи (имя, размер, цветовой ключ)
+    def preload(self, items):
+        for item in items:
+            if isinstance(item, str):
+                self.get(item)
+            else:
+                self.get(*item)
+
+
+# шрифты по ключу (файл шрифта, размер), каждый создается один раз
+fonts = {}
+
+
+# функция получения шрифта, face=None - стандартный шрифт pygame'a
+def get_font(size, face=None):
+    font = fonts.get((face, size))
+    if font is None:
+        font = fonts[(face, size)] = pygame.font.Font(face, size)
+    return font
+
+
+# класс кэша отрисованного текста по ключу (строка, шрифт, цвет), хранит limit последних надписей
+class TextCache:
+    def __init__(self, limit=256):
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self.texts = OrderedDict()
+
+    def render(self, text, size, color, face=None):
+        color = pygame.Color(color)
+        key = (text, face, size, tuple(color))
+        surface = self.texts.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.texts.move_to_end(key)
+            return surface
+        self.misses += 1
+        profiler.count('font_renders')
+        surface = self.texts[key] = get_font(size, face).render(text, True, color)
+        if len(self.texts) > self.limit:
+            self.texts.popitem(last=False)
+        return surface
+
+
+text_cache = TextCache()
+profiler = instrument.Profiler()  # замеры для оверлея F3, выключены, пока его не открыли
+
 # объявление важных списков, переменных и групп
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 clock = pygame.time.Clock()
+image_cache = ImageCache()
+image_cache.preload([('goose1.png', (WIDTH, HEIGHT), None), ('goose2.png', (WIDTH, HEIGHT), None),
+                     ('p_button3_1.png', (320, 80)), ('p_button3_2.png', (320, 80)),
+                     ('cust_button3_1.png', (320, 80)), ('cust_button3_2.png', (320, 80)),
+                     ('stat_button_1.png', (320, 80)), ('stat_button_2.png', (320, 80)),
+                     ('sound_on.png', (50, 50)), ('sound_off.png', (50, 50)),
+                     ('question.png', (100, 100))])
 tile_width = tile_height = 100
-button_sprite = pygame.sprite.Group()
 all_sprites = pygame.sprite.Group()
 tiles_group = pygame.sprite.Group()
 player_group = pygame.sprite.Group()
@@ -56,294 +164,1000 @@ borders = pygame.sprite.Group()
 for_mask = pygame.sprite.Group()
 coins = pygame.sprite.Group()
 portals = pygame.sprite.Group()
+
+
+# класс сетки для быстрого поиска столкновений, ячейка равна клетке уровня
+class SpatialGrid:
+    def __init__(self, cell_size=100):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    # ячейки, которые задевает прямоугольник
+    def cells_for(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def add(self, sprite, kind):
+        for cell in self.cells_for(sprite.rect):
+            self.cells.setdefault((kind, cell), []).append(sprite)
+
+    def remove(self, sprite, kind):
+        for cell in self.cells_for(sprite.rect):
+            bucket = self.cells.get((kind, cell))
+            if bucket and sprite in bucket:
+                bucket.remove(sprite)
+                if not bucket:
+                    del self.cells[(kind, cell)]
+
+    def clear(self):
+        self.cells.clear()
+
+    # живые спрайты данного типа из ячеек, которые задевает rect
+    def query(self, rect, kind):
+        found = []
+        seen = set()
+        for cell in self.cells_for(rect):
+            for sprite in self.cells.get((kind, cell), ()):
+                if sprite not in seen and sprite.alive():
+                    seen.add(sprite)
+                    found.append(sprite)
+        return found
+
+    # первый спрайт данного типа, чей прямоугольник пересекается с rect
+    def collide_rect(self, rect, kind):
+        sprites = self.query(rect, kind)
+        profiler.count('collisions', len(sprites))
+        for sprite in sprites:
+            if rect.colliderect(sprite.rect):
+                return sprite
+        return None
+
+
+grid = SpatialGrid(100)
+
+
+# класс заранее отрисованного статичного слоя уровня (блоки, шипы, портал), нарезанного на куски
+class StaticLayer:
+    def __init__(self, chunk_columns=8):
+        self.chunk_width = chunk_columns * tile_width
+        self.chunks = {}
+
+    # рисуем неподвижные спрайты на поверхности кусков, через которые они проходят
+    def bake(self, sprites, height):
+        width = self.chunk_width
+        for sprite in sprites:
+            for index in range(sprite.rect.left // width, (sprite.rect.right - 1) // width + 1):
+                chunk = self.chunks.get(index)
+                if chunk is None:
+                    chunk = pygame.Surface((width, height)).convert()
+                    chunk.fill(CHUNK_COLOR_KEY)
+                    chunk.set_colorkey(CHUNK_COLOR_KEY, pygame.RLEACCEL)
+                    self.chunks[index] = chunk
+                chunk.blit(sprite.image, (sprite.rect.x - index * width, sprite.rect.y))
+
+    def clear(self):
+        self.chunks.clear()
+
+    # выкидываем куски, которые целиком левее x
+    def discard_before(self, x):
+        for index in [index for index in self.chunks if (index + 1) * self.chunk_width <= x]:
+            del self.chunks[index]
+
+    # рисуем только куски, попадающие в камеру
+    def draw(self, camera):
+        width = self.chunk_width
+        view = camera.viewport()
+        for index in range(view.left // width, (view.right - 1) // width + 1):
+            chunk = self.chunks.get(index)
+            if chunk is not None:
+                screen.blit(chunk, (index * width - camera.x, 0))
+                profiler.count('blits')
+
+
+static_layer = StaticLayer(CHUNK_COLUMNS)
 tile_images = {
-    'empty': None, 'wall': pygame.transform.scale(load_image('block3.png'), (100, 100)),
+    'empty': None, 'wall': image_cache.get('block3.png', (100, 100)),
     'border': 1}
-sounds = [pygame.mixer.Sound('sounds/menu_music.mp3'),
-          pygame.mixer.Sound('sounds/level_music.mp3'),
-          pygame.mixer.Sound('sounds/level_music_2.mp3'),
-          pygame.mixer.Sound('sounds/level_music_3.mp3'),
-          pygame.mixer.Sound('sounds/level_music_4.mp3'),
-          pygame.mixer.Sound('sounds/level_music_5.mp3'),
-          pygame.mixer.Sound('sounds/store_music.mp3'),
-          pygame.mixer.Sound('sounds/coin.mp3'),
-          pygame.mixer.Sound('sounds/hit_in_border.mp3')]
+# музыка играет потоком через pygame.mixer.music и читается с диска, только когда ее включают,
+# а короткие звуки загружаются при первом проигрывании и остаются в effects
+MENU_MUSIC = 'menu_music.mp3'
+STORE_MUSIC = 'store_music.mp3'
+LEVEL_MUSIC = ['level_music.mp3', 'level_music_2.mp3', 'level_music_3.mp3',
+               'level_music_4.mp3', 'level_music_5.mp3']
+MUSIC_VOLUME = 0.05
+EFFECT_VOLUMES = {'coin.mp3': 0.2, 'hit_in_border.mp3': 0.05}
+effects = {}
 cheated = False
 
 
+def play_music(name, loops=-1):
+    pygame.mixer.music.load(os.path.join('sounds', name))
+    pygame.mixer.music.play(loops)
+    sound_control()
+
+
+def stop_music():
+    pygame.mixer.music.stop()
+
+
+def play_effect(name):
+    if name not in effects:
+        effects[name] = pygame.mixer.Sound(os.path.join('sounds', name))
+        sound_control()
+    effects[name].play()
+
+
 # функция для контролирования звука
 def sound_control():
-    if sound_count % 2 != 0:
-        for sound in sounds:
-            sound.set_volume(0)
-    else:
-        for i in range(len(sounds)):
-            if i == 7:
-                sounds[i].set_volume(0.2)
-            else:
-                sounds[i].set_volume(0.05)
+    muted = sound_count % 2 != 0
+    pygame.mixer.music.set_volume(0 if muted else MUSIC_VOLUME)
+    for name, effect in effects.items():
+        effect.set_volume(0 if muted else EFFECT_VOLUMES[name])
+
+
+# банки кадров: картинки вместе с масками, считаются один раз на скин или вид шипов
+frame_banks = {}
+
+
+# кадры бега и прыжка скина из data/<скин>pl_go_anim и pl_jump_anim
+def get_player_frames(way):
+    bank = frame_banks.get(way)
+    if bank is None:
+        # атлас из compiled_skins - одна картинка на скин, без него кадры грузятся по одному
+        images = skin_atlas.load(way, PLAYER_SIZE)
+        if images is None:
+            images = {anim: [image_cache.get(way + anim + '/' + name, PLAYER_SIZE)
+                             for name in skin_atlas.frame_names(way, anim)]
+                      for anim in skin_atlas.ANIMS}
+        bank = {anim: [(image, pygame.mask.from_surface(image)) for image in frames]
+                for anim, frames in images.items()}
+        frame_banks[way] = bank
+    return bank['pl_go_anim'], bank['pl_jump_anim']
+
+
+# полупрозрачная картинка призрака, одна на скин
+ghost_images = {}
+
+
+def get_ghost_image(way):
+    image = ghost_images.get(way)
+    if image is None:
+        image = ghost_images[way] = get_player_frames(way)[0][0][0].copy()
+        image.set_alpha(GHOST_ALPHA)
+    return image
+
+
+# кадр шипов, направленных вверх (placed_down) или вниз
+def get_spike_frame(placed_down):
+    key = 'spikes' if placed_down else 'up_spikes'
+    bank = frame_banks.get(key)
+    if bank is None:
+        image = image_cache.get(key + '.png', (100, 100))
+        bank = frame_banks[key] = (image, pygame.mask.from_surface(image))
+    return bank
+
+
+# кадр барьера высотой height, барьеры всегда шириной в 1 пиксель
+def get_border_frame(height):
+    key = ('border', height)
+    bank = frame_banks.get(key)
+    if bank is None:
+        image = pygame.Surface([1, height])
+        bank = frame_banks[key] = (image, pygame.mask.from_surface(image))
+    return bank
+
+
+# пулы спрайтов: убранные с уровня спрайты ждут здесь, пока не понадобятся снова
+sprite_pools = {}
+
+
+# берем спрайт из пула или создаем новый
+def spawn(cls, *args):
+    pool = sprite_pools.get(cls)
+    if pool:
+        sprite = pool.pop()
+        sprite.place(*args)
+        return sprite
+    return cls(*args)
+
+
+# убираем спрайт с уровня и кладем в пул
+def recycle(sprite):
+    grid.remove(sprite, sprite.kind)
+    sprite.kill()
+    sprite_pools.setdefault(type(sprite), []).append(sprite)
 
 
 # класс барьеров вокруг блоков
 class Border(pygame.sprite.Sprite):
+    kind = 'borders'
+
     def __init__(self, x1, y1, x2, y2):
-        super().__init__(all_sprites, for_mask, borders)
-        self.image = pygame.Surface([1, y2 - y1])
-        self.mask = pygame.mask.from_surface(self.image)
+        super().__init__()
+        self.place(x1, y1, x2, y2)
+
+    # ставим спрайт на уровень, так же он переиспользуется из пула
+    def place(self, x1, y1, x2, y2):
+        self.add(all_sprites, for_mask, borders)
+        self.image, self.mask = get_border_frame(y2 - y1)
         self.rect = pygame.Rect(x1, y1, 1, y2 - y1)
+        grid.add(self, self.kind)
 
 
 # класс блоков и пустоты
 class Tile(pygame.sprite.Sprite):
+    kind = 'tiles'
+
     def __init__(self, tile_type, pos_x, pos_y):
-        super().__init__(tiles_group, all_sprites)
+        super().__init__()
+        self.place(tile_type, pos_x, pos_y)
+
+    def place(self, tile_type, pos_x, pos_y):
+        self.add(tiles_group, all_sprites)
         self.image = tile_images[tile_type]
         self.rect = self.image.get_rect().move(tile_width * pos_x, tile_height * pos_y)
+        grid.add(self, self.kind)
 
 
 # класс шипов
 class Spike(pygame.sprite.Sprite):
+    kind = 'spikes'
+
     def __init__(self, pos_x, pos_y, placed_down=True):
-        super().__init__(spike_group, all_sprites, for_mask)
-        if placed_down:
-            self.image = pygame.transform.scale(load_image('spikes.png'), (100, 100))
-        else:
-            self.image = pygame.transform.scale(load_image('up_spikes.png'), (100, 100))
+        super().__init__()
+        self.place(pos_x, pos_y, placed_down)
+
+    def place(self, pos_x, pos_y, placed_down=True):
+        self.add(spike_group, all_sprites, for_mask)
+        self.image, self.mask = get_spike_frame(placed_down)
         self.rect = self.image.get_rect().move(tile_width * pos_x, tile_height * pos_y)
-        self.mask = pygame.mask.from_surface(self.image)
+        grid.add(self, self.kind)
 
 
-# класс монеток
+# класс монеток, кадры анимации и ее счетчик общие для всех монеток
 class Coin(pygame.sprite.Sprite):
-    def __init__(self, sheet, columns, rows, x, y, pos_x, pos_y):
-        super().__init__(all_sprites, coins)
-        self.count = 5
-        self.x = x
-        self.y = y
-        self.frames = []
-        self.cut_sheet(sheet, columns, rows)
-        self.cur_frame = 0
-        self.image = self.frames[self.cur_frame]
-        self.mask = pygame.mask.from_surface(self.image)
-        self.rect = self.image.get_rect().move(tile_width * pos_x, tile_height * pos_y)
+    kind = 'coins'
+    frames = []  # пары (картинка, маска), нарезаются один раз
+    count = 5
+    cur_frame = 0
+
+    def __init__(self, pos_x, pos_y):
+        super().__init__()
+        self.place(pos_x, pos_y)
+
+    def place(self, pos_x, pos_y):
+        self.add(all_sprites, coins)
+        self.rect = pygame.Rect(tile_width * pos_x, tile_height * pos_y, 60, 64)
+        grid.add(self, self.kind)
+
+    @property
+    def image(self):
+        return Coin.frames[Coin.cur_frame][0]
+
+    @property
+    def mask(self):
+        return Coin.frames[Coin.cur_frame][1]
 
-    # нарезаем фреймы
-    def cut_sheet(self, sheet, columns, rows):
-        self.rect = pygame.Rect(0, 0, self.x, self.y)
+    # нарезаем фреймы и считаем их маски
+    @classmethod
+    def cut_sheet(cls, sheet, columns, rows, x, y):
+        cls.frames = []
         for j in range(rows):
             for i in range(columns):
-                frame_location = (self.rect.w * i + i * 4, self.rect.h * j)
-                self.frames.append(sheet.subsurface(pygame.Rect(
-                    frame_location, self.rect.size)))
+                frame = sheet.subsurface(pygame.Rect((x * i + i * 4, y * j), (x, y)))
+                cls.frames.append((frame, pygame.mask.from_surface(frame)))
 
-    # обновление
-    def update(self):
-        if self.count % 5 == 0:
-            self.cur_frame = (self.cur_frame + 1) % len(self.frames)
-            self.image = self.frames[self.cur_frame]
-        self.count += 1
+    # сброс анимации в начале уровня
+    @classmethod
+    def reset(cls):
+        if not cls.frames:
+            cls.cut_sheet(image_cache.get('coin.png'), 8, 1, 60, 64)
+        cls.count = 5
+        cls.cur_frame = 0
+
+    # обновление анимации сразу всех монеток, вызывается один раз за кадр
+    @classmethod
+    def tick(cls):
+        if cls.count % 5 == 0:
+            cls.cur_frame = (cls.cur_frame + 1) % len(cls.frames)
+        cls.count += 1
 
 
 # класс портала, для прохождения уровня
 class Portal(pygame.sprite.Sprite):
+    kind = 'portals'
+
     def __init__(self, pos_x, pos_y):
-        super().__init__(portals, all_sprites)
-        self.image = pygame.transform.scale(load_image('portal.jpg', None), (80, 100))
+        super().__init__()
+        self.place(pos_x, pos_y)
+
+    def place(self, pos_x, pos_y):
+        self.add(portals, all_sprites)
+        self.image = image_cache.get('portal.jpg', (80, 100), None)
         self.rect = self.image.get_rect().move(tile_width * pos_x, tile_height * pos_y)
+        grid.add(self, self.kind)
 
 
 # класс игрока
 class Player(pygame.sprite.Sprite):
+    kind = 'player'
+
     def __init__(self, pos_x, pos_y, way=''):
-        super().__init__(player_group, all_sprites)
+        super().__init__()
+        self.place(pos_x, pos_y, way)
+
+    # ставим игрока в начало уровня и сбрасываем счетчики, так же и при перезапуске
+    def place(self, pos_x, pos_y, way=''):
+        self.add(player_group, all_sprites)
         self.coins_count = 0
         self.s_x, self.s_y = 5, 1
         self.score = 0
         self.count = 0
         self.jump_p = False
-        self.frames = []
-        for item in os.listdir(path='data/' + way + "pl_go_anim"):
-            item = way + 'pl_go_anim/' + item
-            self.frames.append(pygame.transform.scale(load_image(item), (70, 80)))
-        self.frames_jump = []
-        for item in os.listdir(path='data/' + way + "pl_jump_anim"):
-            item = way + 'pl_jump_anim/' + item
-            self.frames_jump.append(pygame.transform.scale(load_image(item), (70, 80)))
+        self.frames, self.frames_jump = get_player_frames(way)
         self.cur_jump_frame = 0
         self.cur_frame = 0
-        self.image = self.frames[self.cur_frame]
-        self.mask = pygame.mask.from_surface(self.image)
+        self.image, self.mask = self.frames[self.cur_frame]
         self.rect = self.image.get_rect().move(tile_width * pos_x + 15, tile_height * pos_y)
+        self.prev_rect = self.rect
+
+    # положение для отрисовки между прошлым и текущим шагом физики, alpha от 0 до 1
+    def lerp_rect(self, alpha):
+        x = self.prev_rect.x + (self.rect.x - self.prev_rect.x) * alpha
+        y = self.prev_rect.y + (self.rect.y - self.prev_rect.y) * alpha
+        return pygame.Rect(round(x), round(y), self.rect.w, self.rect.h)
 
-    # функция для ходьбы и прыжка персонажа
-    def go(self, level_name, num):
+    # функция для ходьбы и прыжка персонажа, один вызов - один шаг физики
+    # возвращает 'win', если игрок дошел до портала, 'dead', если разбился, иначе None
+    def go(self):
+        self.prev_rect = self.rect
         if self.count % 10 == 0 and self.jump_p:
             self.cur_frame = (self.cur_frame + 1) % len(self.frames)
-            self.image = self.frames[self.cur_frame]
-            self.mask = pygame.mask.from_surface(self.image)
+            self.image, self.mask = self.frames[self.cur_frame]
             self.cur_jump_frame = 0
         elif not self.jump_p:
             if self.count % 5 == 0:
                 self.cur_jump_frame = (self.cur_jump_frame + 1) % len(self.frames_jump)
-                self.image = self.frames_jump[self.cur_jump_frame]
+                self.image, self.mask = self.frames_jump[self.cur_jump_frame]
         self.count += 1
         self.rect = self.rect.move(self.s_x, self.s_y)
-        if pygame.sprite.spritecollideany(self, portals):
-            win(self.coins_count, num, self.score, level_name)
-        if pygame.sprite.spritecollideany(self, tiles_group):
+        # проверяем только спрайты из ячеек сетки, которые задевает игрок
+        if grid.collide_rect(self.rect, 'portals'):
+            return 'win'
+        if grid.collide_rect(self.rect, 'tiles'):
             self.jump_p = True
             self.rect = self.rect.move(0, -self.s_y)
             self.s_y = 0
             self.s_x = 7
-        elif not pygame.sprite.spritecollideany(self, tiles_group):
+        else:
             self.jump_p = False
-        for sprite in for_mask:
+        hazards = grid.query(self.rect, 'borders') + grid.query(self.rect, 'spikes')
+        near_coins = grid.query(self.rect, 'coins')
+        profiler.count('collisions', len(hazards) + len(near_coins))
+        for sprite in hazards:
             if pygame.sprite.collide_mask(self, sprite):
-                game_over(level_name, num, self.score, self.coins_count)
-        for sprite in coins:
+                return 'dead'
+        for sprite in near_coins:
             if pygame.sprite.collide_mask(self, sprite):
                 self.coins_count += 1
+                grid.remove(sprite, 'coins')
                 sprite.kill()
-                sounds[7].play()
         self.s_y += GRAVITY
+        return None
 
     # функция прыжка
     def jump(self):
         if self.jump_p:
             self.cur_jump_frame = 0
             self.jump_p = False
-            self.s_y = -29
-            self.s_x = 8
+            self.s_y = -JUMP_SPEED
+            self.s_x = JUMP_SPEED_X
 
 
 # функция прекращения работы
 def terminate():
-    con.close()
+    db.close()
     pygame.quit()
     sys.exit()
 
 
-# функция загрузки уровня
+# функция загрузки уровня, берет скомпилированный вариант из compiled_levels/, если он свежий,
+# а для endless_<зерно> создает бесконечный уровень
 def load_level(filename):
-    filename = 'levels/' + filename
-    with open(filename, 'r') as map_file:
-        level_map = [line.strip() for line in map_file]
-        max_width = max(map(len, level_map))
-    return list(map(lambda line: line.ljust(max_width, '.'), level_map))
-
-
-# функция генерации уровня
-def generate_level(level):
-    new_player, x, y = None, None, None
-    for y in range(len(level)):
-        for x in range(len(level[y])):
-            if (level[y][x] == '' or level[y][x] == '.') and cheated:
-                Coin(load_image('coin.png', -1), 8, 1, 60, 64, x, y)
-            elif level[y][x] == '#':
-                Border(x * 100, y * 100 + 5, x * 100, (y + 1) * 100 - 5)
-                Border((x + 1) * 100, y * 100 + 5, (x + 1) * 100, (y + 1) * 100 - 5)
-                Border(x * 100, y * 100 + 95, (x + 1) * 100, (y + 1) * 100)
-                Tile('wall', x, y)
-            elif level[y][x] == '@':
-                new_player = Player(x, y, sets_dict[set_for_playing])
-            elif level[y][x] == '^':
-                Spike(x, y)
-            elif level[y][x] == 'v':
-                Spike(x, y, False)
-            elif level[y][x] == '0':
-                Coin(load_image('coin.png', -1), 8, 1, 60, 64, x, y)
-            elif level[y][x] == '$':
-                Portal(x, y)
-    return new_player, x, y
-
-
-# класс камеры
+    if filename.startswith(ENDLESS_PREFIX):
+        return endless.EndlessLevel(int(filename[len(ENDLESS_PREFIX):]), JUMP_SPEED,
+                                    JUMP_SPEED_X, GRAVITY, PLAYER_SIZE)
+    return level_format.load(filename)
+
+
+# имя бесконечного уровня на сегодня, у всех игроков в один день одинаковое зерно
+def endless_level_name():
+    return ENDLESS_PREFIX + time.strftime('%Y%m%d')
+
+
+# функция генерации уровня по level_format.LevelData,
+# skin и with_coins по умолчанию берутся из настроек игры
+def generate_level(level, bake=BAKE_STATIC, skin=None, with_coins=None):
+    skin = set_for_playing if skin is None else skin
+    with_coins = cheated if with_coins is None else with_coins
+    new_player = None
+    grid.clear()
+    static_layer.clear()
+    Coin.reset()
+    if with_coins:
+        for x, y in level.empty_cells():
+            spawn(Coin, x, y)
+    # у подряд идущих блоков боковые барьеры нужны только по краям отрезка
+    for y, x1, x2 in level.wall_spans:
+        spawn(Border, x1 * 100, y * 100 + 5, x1 * 100, (y + 1) * 100 - 5)
+        spawn(Border, (x2 + 1) * 100, y * 100 + 5, (x2 + 1) * 100, (y + 1) * 100 - 5)
+        for x in range(x1, x2 + 1):
+            spawn(Border, x * 100, y * 100 + 95, (x + 1) * 100, (y + 1) * 100)
+            spawn(Tile, 'wall', x, y)
+    if level.spawn is not None:
+        new_player = spawn(Player, *level.spawn, sets_dict[skin])
+    for x, y in level.spikes:
+        spawn(Spike, x, y)
+    for x, y in level.up_spikes:
+        spawn(Spike, x, y, False)
+    for x, y in level.coins:
+        spawn(Coin, x, y)
+    for x, y in level.portals:
+        spawn(Portal, x, y)
+    if bake:
+        static_layer.bake(list(tiles_group) + list(spike_group) + list(portals),
+                          level.height * tile_height)
+    return new_player, level.width - 1, level.height - 1
+
+
+# класс потоковой загрузки уровня: спрайты есть только у столбцов рядом с камерой,
+# source - что угодно с width, height и column(x), например level_format.LevelData
+class LevelStream:
+    def __init__(self, source, bake=BAKE_STATIC, skin=None, with_coins=None):
+        self.source = source
+        self.bake = bake
+        self.skin = set_for_playing if skin is None else skin
+        self.with_coins = cheated if with_coins is None else with_coins
+        self.columns = {}  # номер столбца -> его спрайты
+        self.next_column = 0
+        self.player = None
+        grid.clear()
+        static_layer.clear()
+        Coin.reset()
+
+    # создаем спрайты одного столбца
+    def spawn_column(self, x):
+        sprites = []
+        for y, char in enumerate(self.source.column(x)):
+            if char == '.' and self.with_coins:
+                sprites.append(spawn(Coin, x, y))
+            elif char == '#':
+                sprites.append(spawn(Border, x * 100, y * 100 + 5, x * 100, (y + 1) * 100 - 5))
+                sprites.append(spawn(Border, (x + 1) * 100, y * 100 + 5,
+                                     (x + 1) * 100, (y + 1) * 100 - 5))
+                sprites.append(spawn(Border, x * 100, y * 100 + 95, (x + 1) * 100, (y + 1) * 100))
+                sprites.append(spawn(Tile, 'wall', x, y))
+            elif char == '@' and self.player is None:
+                self.player = spawn(Player, x, y, sets_dict[self.skin])
+            elif char == '^':
+                sprites.append(spawn(Spike, x, y))
+            elif char == 'v':
+                sprites.append(spawn(Spike, x, y, False))
+            elif char == '0':
+                sprites.append(spawn(Coin, x, y))
+            elif char == '$':
+                sprites.append(spawn(Portal, x, y))
+        if self.bake:
+            static_layer.bake([sprite for sprite in sprites if sprite.kind != 'borders' and
+                               sprite.kind != 'coins'], self.source.height * tile_height)
+        self.columns[x] = sprites
+
+    # подгружаем столбцы перед камерой и убираем оставшиеся позади
+    def update(self, camera):
+        view = camera.viewport()
+        last = view.right // tile_width + STREAM_AHEAD
+        if self.source.width is not None:
+            last = min(last, self.source.width - 1)
+        while self.next_column <= last:
+            self.spawn_column(self.next_column)
+            self.next_column += 1
+        first = view.left // tile_width - STREAM_BEHIND
+        for x in [x for x in self.columns if x < first]:
+            for sprite in self.columns.pop(x):
+                recycle(sprite)
+        static_layer.discard_before(first * tile_width)
+
+    # первые столбцы уровня до появления игрока, возвращает игрока
+    def start(self, camera):
+        while self.player is None and (self.source.width is None or
+                                       self.next_column < self.source.width):
+            self.spawn_column(self.next_column)
+            self.next_column += 1
+        camera.update(self.player.rect)
+        self.update(camera)
+        return self.player
+
+
+# функция удаления всех спрайтов уровня, сами спрайты уходят в пулы
+def clear_level():
+    for sprite in all_sprites:
+        sprite.kill()
+        sprite_pools.setdefault(type(sprite), []).append(sprite)
+    grid.clear()
+    static_layer.clear()
+
+
+# класс уровня: файл читается один раз, а перезапуск возвращает уровень в начальное состояние
+class Level:
+    def __init__(self, name):
+        self.name = name
+        self.data = load_level(name)
+        self.camera = Camera((None if self.data.width is None else self.data.width - 1,
+                              self.data.height - 1))
+        self.stream = None
+        self.coins = []  # все монетки уровня, если он построен целиком
+        self.player = None
+        self.build()
+
+    def build(self):
+        # бесконечный уровень целиком не построить, он всегда подгружается по столбцам
+        if STREAM_LEVELS or self.data.width is None:
+            self.stream = LevelStream(self.data)
+            self.player = self.stream.start(self.camera)
+        else:
+            self.player = generate_level(self.data)[0]
+            self.coins = list(coins)
+
+    # перезапуск без перестройки: собранные монетки возвращаются, игрок встает в начало
+    def reset(self):
+        if self.stream is not None:
+            # при потоковой загрузке начало уровня уже убрано, строим его заново из пулов,
+            # бесконечный уровень заново генерируется по тому же зерну
+            for column in self.stream.columns.values():
+                for sprite in column:
+                    recycle(sprite)
+            clear_level()
+            if self.data.width is None:
+                self.data = load_level(self.name)
+            self.build()
+            return
+        for coin in self.coins:
+            if not coin.alive():
+                coin.add(all_sprites, coins)
+                grid.add(coin, coin.kind)
+        Coin.reset()
+        self.player.place(*self.data.spawn, sets_dict[set_for_playing])
+        self.camera.update(self.player.rect)
+
+
+# один шаг физики уровня, возвращает то же, что и Player.go
+def step_level(player):
+    profiler.start('physics')
+    Coin.tick()
+    status = player.go()
+    if status is None:
+        player.score = player.count // 2 + 100 * player.coins_count
+    profiler.stop('physics')
+    return status
+
+
+# класс камеры, спрайты живут в координатах мира, а камера сдвигает их только при отрисовке
 class Camera:
     def __init__(self, field_size):
-        self.dx = 0
+        self.x = 0
         self.field_size = field_size
 
-    def apply(self, obj):
-        obj.rect.x += self.dx
-
-    def update(self, target):
-        self.dx = -(target.rect.x + target.rect.w // 2 - WIDTH // 2)
-
-
-# функция включения чит-режима)
-def cheating():
-    global cheated
-    font = pygame.font.Font(None, 32)
-    clock = pygame.time.Clock()
-    input_box = pygame.Rect(100, 100, 140, 32)
-    color_inactive = pygame.Color('lightskyblue3')
-    color_active = pygame.Color('dodgerblue2')
-    color = color_inactive
-    active = False
-    text = ''
-    done = False
-    while not done:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+    # прямоугольник в координатах экрана
+    def apply(self, rect):
+        return rect.move(-self.x, 0)
+
+    # видимая часть мира
+    def viewport(self):
+        return pygame.Rect(self.x, 0, WIDTH, HEIGHT)
+
+    def update(self, target_rect):
+        profiler.start('camera')
+        self.x = target_rect.x + target_rect.w // 2 - WIDTH // 2
+        profiler.stop('camera')
+
+
+# порядок слоев при отрисовке уровня
+LEVEL_LAYERS = ('tiles', 'spikes', 'coins', 'portals', 'ghost', 'player', 'hud')
+# то же, когда блоки, шипы и портал заранее отрисованы в static_layer
+BAKED_LAYERS = ('static', 'coins', 'ghost', 'player', 'hud')
+
+
+# класс надписи интерфейса уровня: текст рисуется заново, только когда меняется значение
+class HudLabel:
+    def __init__(self, template, size, color, pos):
+        self.template = template
+        self.size = size
+        self.color = pygame.Color(color)
+        self.pos = pos
+        self.value = None
+        self.surface = None
+
+    def draw(self, value):
+        if self.surface is None or value != self.value:
+            self.value = value
+            self.surface = get_font(self.size).render(self.template.format(value), True,
+                                                      self.color)
+            profiler.count('font_renders')
+        screen.blit(self.surface, self.pos)
+        profiler.count('blits')
+
+
+hud_labels = {'coins': HudLabel('{}', 72, 'yellow', (10, 10)),
+              'score': HudLabel('Ваши очки: {}', 30, 'green', (600, 10)),
+              'best': HudLabel('Ваш последний счет: {}', 30, 'green', (300, 10))}
+
+
+# функция отрисовки интерфейса уровня
+def draw_hud(player, best_score):
+    profiler.start('hud')
+    screen.blit(image_cache.get('coin.png'), (60, 0), pygame.Rect(0, 0, 60, 64))
+    profiler.count('blits')
+    hud_labels['coins'].draw(player.coins_count)
+    hud_labels['score'].draw(player.score)
+    hud_labels['best'].draw(best_score)
+    profiler.stop('hud')
+
+
+# функция отрисовки кадра уровня, каждый видимый спрайт рисуется ровно один раз,
+# ghost - (картинка, прямоугольник) призрака или None
+def render_level(camera, player, player_rect, best_score, layers=LEVEL_LAYERS, ghost=None):
+    profiler.start('draw')
+    view = camera.viewport()
+    for layer in layers:
+        if layer == 'static':
+            static_layer.draw(camera)
+        elif layer == 'player':
+            screen.blit(player.image, camera.apply(player_rect))
+            profiler.count('blits')
+        elif layer == 'ghost':
+            if ghost is not None:
+                screen.blit(ghost[0], camera.apply(ghost[1]))
+                profiler.count('blits')
+        elif layer == 'hud':
+            profiler.stop('draw')
+            draw_hud(player, best_score)
+            profiler.start('draw')
+        else:
+            sprites = grid.query(view, layer)
+            for sprite in sprites:
+                screen.blit(sprite.image, camera.apply(sprite.rect))
+            profiler.count('blits', len(sprites))
+    profiler.stop('draw')
+
+
+# класс оверлея замеров на уровне: FPS, график длительности кадров и счетчики прошлого кадра;
+# текст обновляется раз в refresh кадров и рисуется мимо text_cache, чтобы не попадать в замеры
+class ProfilerOverlay:
+    groups = {'all_sprites': all_sprites, 'for_mask': for_mask, 'coins': coins,
+              'tiles_group': tiles_group}
+
+    def __init__(self, rect=(10, 80, 420, 190), size=20, refresh=15, graph_ms=50):
+        self.rect = pygame.Rect(rect)
+        self.size = size
+        self.refresh = refresh
+        self.graph_ms = graph_ms  # длительность кадра, которой соответствует вся высота графика
+        self.panel = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self.lines = []
+        self.frames = 0
+
+    def update_lines(self, frame):
+        font = get_font(self.size)
+        counters = [f'FPS {clock.get_fps():.0f}   кадр {frame["frame_ms"]:.1f} мс',
+                    '  '.join(f'{name} {frame.get(name, 0):.2f}'
+                              for name in ('physics', 'camera', 'draw', 'hud')),
+                    '  '.join(f'{name} {frame.get(name, 0)}' for name in self.groups),
+                    f'collisions {frame.get("collisions", 0)}  blits {frame.get("blits", 0)}  '
+                    f'font_renders {frame.get("font_renders", 0)}']
+        if profiler.tracing:
+            counters.append(f'F4: запись трассы, кадров {len(profiler.trace)}')
+        self.lines = [font.render(line, True, pygame.Color('white')) for line in counters]
+
+    def draw(self):
+        for name, group in self.groups.items():
+            profiler.set(name, len(group))
+        if not profiler.history:
+            return
+        if self.frames % self.refresh == 0:
+            self.update_lines(profiler.history[-1])
+        self.frames += 1
+        self.panel.fill((0, 0, 0, 160))
+        y = 5
+        for line in self.lines:
+            self.panel.blit(line, (5, y))
+            y += line.get_height()
+        # график: столбик на кадр, линия - бюджет кадра при RENDER_FPS
+        bottom = self.rect.h - 5
+        height = bottom - y - 5
+        for i, frame in enumerate(profiler.history):
+            bar = min(height, round(frame['frame_ms'] / self.graph_ms * height))
+            pygame.draw.line(self.panel, (0, 255, 0), (5 + i * 3, bottom),
+                             (5 + i * 3, bottom - bar), 2)
+        if RENDER_FPS:
+            budget = bottom - round(1000 / RENDER_FPS / self.graph_ms * height)
+            pygame.draw.line(self.panel, (255, 80, 80), (5, budget), (self.rect.w - 5, budget))
+        screen.blit(self.panel, self.rect)
+
+
+# включение и выключение записи трассы замеров в trace_<время>.csv
+def toggle_trace():
+    if profiler.tracing:
+        path = time.strftime('trace_%Y%m%d_%H%M%S.csv')
+        print(f'{path}: {profiler.stop_trace(path)} frames')
+    else:
+        if not profiler.enabled:
+            profiler.toggle()
+        profiler.start_trace()
+
+
+profiler_overlay = ProfilerOverlay()
+
+
+# функция вывода строк текста столбиком, как на всех экранах игры
+def draw_lines(lines, size, color, text_coord=50, x=10):
+    for line in lines:
+        string_render = text_cache.render(line, size, color)
+        string_rect = string_render.get_rect()
+        text_coord += 10
+        string_rect.top = text_coord
+        string_rect.x = x
+        text_coord += string_rect.height
+        screen.blit(string_render, string_rect)
+    return text_coord
+
+
+# класс кнопки: обычная картинка и картинка при наведении масштабируются один раз, при создании,
+# надпись label сразу рисуется на обеих
+class Button(pygame.sprite.Sprite):
+    def __init__(self, image, hover_image, pos, size, action=None, label=None):
+        super().__init__()
+        self.action = action  # что делать при нажатии, без action кнопка - просто картинка
+        self.label = label
+        self.hovered = False
+        self.set_images(image, hover_image, size)
+        self.rect = self.image.get_rect().move(pos)
+
+    # смена картинок, например у кнопки звука
+    def set_images(self, image, hover_image, size):
+        self.normal = self.with_label(image_cache.get(image, size))
+        self.hover = self.with_label(image_cache.get(hover_image, size)) if hover_image \
+            else self.normal
+        self.image = self.hover if self.hovered else self.normal
+
+    def with_label(self, image):
+        if self.label is None:
+            return image
+        size, text, color = self.label
+        image = image.copy()
+        text = text_cache.render(text, size, color)
+        image.blit(text, text.get_rect(center=image.get_rect().center))
+        return image
+
+    def set_hovered(self, hovered):
+        self.hovered = hovered
+        self.image = self.hover if hovered else self.normal
+
+
+# класс виджетов сцены: сцена владеет ими, рисует их и отдает им события мыши,
+# кнопка под курсором ищется одним проходом, а перерисовываются только сменившие вид кнопки
+class Widgets(pygame.sprite.Group):
+    def __init__(self, scene):
+        super().__init__()
+        self.scene = scene
+        self.hovered = None
+
+    def add_button(self, *args, **kwargs):
+        button = Button(*args, **kwargs)
+        self.add(button)
+        return button
+
+    # верхний виджет под точкой pos
+    def widget_at(self, pos):
+        for widget in reversed(self.sprites()):
+            if widget.rect.collidepoint(pos):
+                return widget
+        return None
+
+    # смена картинок у кнопки с перерисовкой
+    def set_images(self, button, *args):
+        button.set_images(*args)
+        self.scene.invalidate(button.rect)
+
+    def handle(self, event):
+        if event.type == pygame.MOUSEMOTION:
+            widget = self.widget_at(event.pos)
+            if widget is not self.hovered:
+                for button in (self.hovered, widget):
+                    if button is not None and button.hover is not button.normal:
+                        button.set_hovered(button is widget)
+                        self.scene.invalidate(button.rect)
+                self.hovered = widget
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            widget = self.widget_at(event.pos)
+            if widget is not None and widget.action is not None:
+                widget.action()
+
+    def empty(self):
+        super().empty()
+        self.hovered = None
+
+
+# класс сцены: один экран игры, которым управляет менеджер сцен
+class Scene:
+    fps = FPS  # ограничение частоты кадров на этой сцене
+    animated = False  # кадр меняется сам, без событий, и его надо рисовать каждый раз
+
+    def __init__(self):
+        self.dirty = []  # места экрана, которые надо перерисовать
+        self.widgets = Widgets(self)  # кнопки живут, пока сцена на экране
+
+    # место экрана надо перерисовать, по умолчанию весь экран
+    def invalidate(self, rect=SCREEN_RECT):
+        self.dirty.append(pygame.Rect(rect))
+
+    # сцена стала текущей
+    def enter(self):
+        pass
+
+    # сцену убирают, вместе с ней пропадают ее кнопки
+    def exit(self):
+        self.widgets.empty()
+
+    # события и логика одного кадра, dt - миллисекунды с прошлого кадра,
+    # по умолчанию события мыши достаются кнопкам
+    def update(self, events, dt):
+        for event in events:
+            self.widgets.handle(event)
+            if scenes.changed:
                 return
+
+    # весь кадр сцены, при перерисовке обрезается до испорченных мест
+    def draw(self):
+        pass
+
+    # перерисовка испорченных мест, возвращает их для display.update,
+    # None - перерисован весь кадр и нужен display.flip
+    def render(self):
+        rects = self.dirty
+        self.dirty = []
+        for rect in rects:
+            screen.set_clip(rect)
+            self.draw()
+        screen.set_clip(None)
+        return rects
+
+
+# класс менеджера сцен: экраны не вызывают друг друга, а просят менеджер сменить сцену,
+# поэтому стек вызовов не растет, сколько бы уровней ни было сыграно
+class SceneManager:
+    def __init__(self):
+        self.stack = []  # сверху текущая сцена, под ней приостановленные (уровень под паузой)
+        self.changed = False
+
+    # замена всех сцен на новую
+    def switch(self, scene):
+        while self.stack:
+            self.stack.pop().exit()
+        self.push(scene)
+
+    # новая сцена поверх текущей
+    def push(self, scene):
+        self.stack.append(scene)
+        scene.enter()
+        scene.invalidate()
+        self.changed = True
+
+    # убираем верхнюю сцену и возвращаемся к предыдущей
+    def pop(self):
+        self.stack.pop().exit()
+        self.stack[-1].invalidate()
+        self.changed = True
+
+    # главный цикл игры: если на сцене ничего не движется и нечего перерисовывать,
+    # ждем события, не занимая процессор
+    def run(self, scene):
+        self.switch(scene)
+        dt = 0
+        while True:
+            self.changed = False
+            scene = self.stack[-1]
+            if scene.animated or scene.dirty:
+                events = pygame.event.get()
+            else:
+                events = [pygame.event.wait()] + pygame.event.get()
+            for event in events:
+                if event.type == pygame.QUIT:
+                    terminate()
+            scene.update(events, dt)
+            if self.changed:
+                # время загрузки новой сцены не считается за кадр
+                clock.tick()
+                dt = 0
+                continue
+            rects = scene.render()
+            if rects is None:
+                pygame.display.flip()
+            elif rects:
+                pygame.display.update(rects)
+            dt = clock.tick(scene.fps)
+
+
+# сцена включения чит-режима)
+class CheatScene(Scene):
+    fps = 30
+
+    def enter(self):
+        self.input_box = pygame.Rect(100, 100, 140, 32)
+        self.color_inactive = pygame.Color('lightskyblue3')
+        self.color_active = pygame.Color('dodgerblue2')
+        self.color = self.color_inactive
+        self.active = False
+        self.text = ''
+
+    def update(self, events, dt):
+        global cheated
+        for event in events:
+            if event.type == pygame.MOUSEBUTTONDOWN or event.type == pygame.KEYDOWN:
+                self.invalidate()
             if event.type == pygame.MOUSEBUTTONDOWN:
-                if input_box.collidepoint(event.pos):
-                    active = not active
+                if self.input_box.collidepoint(event.pos):
+                    self.active = not self.active
                 else:
-                    active = False
-                color = color_active if active else color_inactive
+                    self.active = False
+                self.color = self.color_active if self.active else self.color_inactive
             if event.type == pygame.KEYDOWN:
-                if active:
+                if self.active:
                     if event.key == pygame.K_RETURN:
-                        print(text)
-                        if text.lower() == 'жумайсынба':
+                        print(self.text)
+                        if self.text.lower() == 'жумайсынба':
                             cheated = not cheated
+                        scenes.pop()
                         return
                     elif event.key == pygame.K_BACKSPACE:
-                        text = text[:-1]
+                        self.text = self.text[:-1]
                     else:
-                        text += event.unicode
+                        self.text += event.unicode
+
+    def draw(self):
         screen.fill((30, 30, 30))
-        text_surface = font.render(text, True, color)
+        text_surface = text_cache.render(self.text, 32, self.color)
         width = max(200, text_surface.get_width() + 10)
-        input_box.w = width
-        screen.blit(text_surface, (input_box.x + 5, input_box.y + 5))
-        pygame.draw.rect(screen, color, input_box, 2)
-
-        pygame.display.flip()
-        clock.tick(30)
-
-
-# функция статового экрана
-def start_screen():
-    sounds[0].play(loops=-1)
-    sounds[0].set_volume(0.05)
-    text = ['Welcome to ', '', 'Goose game']
-    background = pygame.transform.scale(load_image('goose1.png', None), (WIDTH, HEIGHT))
-    screen.blit(background, (0, 0))
-    font = pygame.font.Font(None, 30)
-    text_coord = 50
-    for line in text:
-        string_render = font.render(line, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        text_coord += 10
-        string_rect.top = text_coord
-        string_rect.x = 10
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            elif event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
-                menu()
-        pygame.display.flip()
-        clock.tick(FPS)
+        self.input_box.w = width
+        screen.blit(text_surface, (self.input_box.x + 5, self.input_box.y + 5))
+        pygame.draw.rect(screen, self.color, self.input_box, 2)
+
+
+# сцена стартового экрана
+class StartScene(Scene):
+    def enter(self):
+        play_music(MENU_MUSIC)
+
+    def draw(self):
+        text = ['Welcome to ', '', 'Goose game']
+        background = image_cache.get('goose1.png', (WIDTH, HEIGHT), None)
+        screen.blit(background, (0, 0))
+        draw_lines(text, 30, pygame.Color('green'))
+
+    def update(self, events, dt):
+        for event in events:
+            if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
+                scenes.switch(MenuScene())
+                return
+
 
 # функция обработки списка из дб
 def transform(s):
     s = list(s)
-    s[0] = s[0].strip('.txt').strip('lev_')
+    if s[0].startswith(ENDLESS_PREFIX):
+        s[0] = 'Забег ' + s[0][len(ENDLESS_PREFIX):]
+    else:
+        s[0] = s[0].strip('.txt').strip('lev_')
     s[1] = str(s[1])
     s[2] = str(s[2])
     s[0] = s[0] + ' ' * (19 - len(s[0]))
@@ -351,653 +1165,379 @@ def transform(s):
     return ''.join(s)
 
 
-# функция меню статистики
-def statistics():
-    image = pygame.transform.scale(load_image('to_menu_btn-1.png'), (320, 80))
-    to_menu = pygame.sprite.Sprite(button_sprite)
-    to_menu.image = image
-    to_menu.rect = to_menu.image.get_rect()
-    to_menu.rect.x, to_menu.rect.y = 250, 500
-    res = ['Уровень   Очки   Монеты']
-    res += list(map(transform, cur.execute('select * from Statistics order by level').fetchall()))
-    background = pygame.transform.scale(load_image('goose1.png', None), (WIDTH, HEIGHT))
-    screen.blit(background, (0, 0))
-    font = pygame.font.Font(None, 34)
-    text_coord = 50
-    for line in res:
-        string_render = font.render(line, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        text_coord += 10
-        string_rect.top = text_coord
-        string_rect.x = 10
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            if event.type == pygame.MOUSEMOTION:
-                x, y = event.pos
-                if to_menu.rect.x < x < to_menu.rect.x + 320 and \
-                        to_menu.rect.y < y < to_menu.rect.y + 80:
-                    to_menu.image = pygame.transform.scale(
-                        load_image('to_menu_btn-2.png'), (320, 80))
-                else:
-                    to_menu.image = pygame.transform.scale(
-                        load_image('to_menu_btn-1.png'), (320, 80))
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = event.pos
-                if to_menu.rect.x < x < to_menu.rect.x + 320 and \
-                        to_menu.rect.y < y < to_menu.rect.y + 80:
-                    to_menu.kill()
-                    menu()
-        button_sprite.draw(screen)
-        pygame.display.flip()
-
-
-# функция главного меню
-def menu():
-    global sound_count
-    sound_control()
-    background = pygame.transform.scale(load_image('goose2.png', None), (WIDTH, HEIGHT))
-    screen.blit(background, (0, 0))
-    image = pygame.transform.scale(load_image('p_button3_1.png'), (320, 80))
-    sound_onoff = pygame.sprite.Sprite(button_sprite)
-    sound_onoff.image = pygame.transform.scale(load_image('sound_on.png', -1), (50, 50))
-    sound_onoff.rect = sound_onoff.image.get_rect()
-    sound_onoff.rect.x, sound_onoff.rect.y = 720, 520
-    play_b = pygame.sprite.Sprite(button_sprite)
-    play_b.image = image
-    play_b.rect = play_b.image.get_rect()
-    play_b.rect.x, play_b.rect.y = 50, 50
-    image = pygame.transform.scale(load_image('cust_button3_1.png'), (320, 80))
-    custom = pygame.sprite.Sprite(button_sprite)
-    custom.image = image
-    custom.rect = custom.image.get_rect()
-    custom.rect.x, custom.rect.y = 50, 200
-    image = pygame.transform.scale(load_image('question.png'), (100, 100))
-    question = pygame.sprite.Sprite(button_sprite)
-    question.image = image
-    question.rect = question.image.get_rect()
-    question.rect.x, question.rect.y = 720, -30
-    image = pygame.transform.scale(load_image('stat_button_1.png'), (320, 80))
-    stats = pygame.sprite.Sprite(button_sprite)
-    stats.image = image
-    stats.rect = stats.image.get_rect()
-    stats.rect.x, stats.rect.y = 50, 350
-    running = True
-    while running:
+# сцена статистики
+class StatsScene(Scene):
+    def enter(self):
+        self.widgets.add_button('to_menu_btn-1.png', 'to_menu_btn-2.png', (250, 500), (320, 80),
+                                lambda: scenes.switch(MenuScene()))
+        self.lines = ['Уровень   Очки   Монеты']
+        self.lines += list(map(transform, db.statistics_rows()))
+
+    def draw(self):
+        screen.blit(image_cache.get('goose1.png', (WIDTH, HEIGHT), None), (0, 0))
+        draw_lines(self.lines, 34, pygame.Color('green'))
+        self.widgets.draw(screen)
+
+
+# сцена главного меню
+class MenuScene(Scene):
+    def enter(self):
         sound_control()
-        screen.blit(background, (0, 0))
-        for event in pygame.event.get():
+        self.background = image_cache.get('goose2.png', (WIDTH, HEIGHT), None)
+        self.sound_onoff = self.widgets.add_button(self.sound_image(), None, (720, 520), (50, 50),
+                                                   self.toggle_sound)
+        self.widgets.add_button('p_button3_1.png', 'p_button3_2.png', (50, 50), (320, 80),
+                                lambda: scenes.switch(LevelSelectScene()))
+        self.widgets.add_button('cust_button3_1.png', 'cust_button3_2.png', (50, 200), (320, 80),
+                                lambda: scenes.switch(ShopScene()))
+        self.widgets.add_button('question.png', None, (720, -30), (100, 100),
+                                lambda: scenes.switch(DescriptionScene()))
+        self.widgets.add_button('stat_button_1.png', 'stat_button_2.png', (50, 350), (320, 80),
+                                lambda: scenes.switch(StatsScene()))
+
+    def sound_image(self):
+        return 'sound_off.png' if sound_count % 2 != 0 else 'sound_on.png'
+
+    def toggle_sound(self):
+        global sound_count
+        sound_count += 1
+        sound_control()
+        self.widgets.set_images(self.sound_onoff, self.sound_image(), None, (50, 50))
+
+    def update(self, events, dt):
+        for event in events:
             keys = pygame.key.get_pressed()
             if keys[pygame.K_LCTRL] and keys[pygame.K_LSHIFT]:
-                cheating()
-            if event.type == pygame.QUIT:
-                terminate()
-            if event.type == pygame.MOUSEMOTION:
-                x, y = event.pos
-                if play_b.rect.x < x < play_b.rect.x + 320 and \
-                        play_b.rect.y < y < play_b.rect.y + 80:
-                    play_b.image = pygame.transform.scale(load_image('p_button3_2.png'), (320, 80))
-                else:
-                    play_b.image = pygame.transform.scale(load_image('p_button3_1.png'), (320, 80))
-                if custom.rect.x < x < custom.rect.x + 320 and \
-                        custom.rect.y < y < custom.rect.y + 80:
-                    custom.image = pygame.transform.scale(
-                        load_image('cust_button3_2.png'), (320, 80))
-                else:
-                    custom.image = pygame.transform.scale(
-                        load_image('cust_button3_1.png'), (320, 80))
-                if stats.rect.x < x < stats.rect.x + 320 and \
-                        stats.rect.y < y < stats.rect.y + 80:
-                    stats.image = pygame.transform.scale(load_image('stat_button_2.png'), (320, 80))
-                else:
-                    stats.image = pygame.transform.scale(load_image('stat_button_1.png'), (320, 80))
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = event.pos
-                if play_b.rect.x < x < play_b.rect.x + 320 and \
-                        play_b.rect.y < y < play_b.rect.y + 80:
-                    play_b.kill()
-                    custom.kill()
-                    stats.kill()
-                    question.kill()
-                    sound_onoff.kill()
-                    play()
-                elif custom.rect.x < x < custom.rect.x + 320 and \
-                        custom.rect.y < y < custom.rect.y + 80:
-                    play_b.kill()
-                    custom.kill()
-                    question.kill()
-                    stats.kill()
-                    sound_onoff.kill()
-                    customizing()
-                elif question.rect.x < x < question.rect.x + 100 and \
-                        question.rect.y < y < question.rect.y + 100:
-                    play_b.kill()
-                    custom.kill()
-                    stats.kill()
-                    question.kill()
-                    sound_onoff.kill()
-                    description()
-                elif stats.rect.x < x < stats.rect.x + 320 and \
-                        stats.rect.y < y < stats.rect.y + 80:
-                    play_b.kill()
-                    stats.kill()
-                    custom.kill()
-                    question.kill()
-                    sound_onoff.kill()
-                    statistics()
-                elif sound_onoff.rect.x < x < sound_onoff.rect.x + 50 and \
-                        sound_onoff.rect.y < y < sound_onoff.rect.y + 50:
-                    sound_count += 1
-            if sound_count % 2 != 0:
-                sound_onoff.image = pygame.transform.scale(load_image('sound_off.png'), (50, 50))
-            else:
-                sound_onoff.image = pygame.transform.scale(load_image('sound_on.png'), (50, 50))
-        button_sprite.draw(screen)
-        pygame.display.flip()
+                scenes.push(CheatScene())
+                return
+            self.widgets.handle(event)
+            if scenes.changed:
+                return
 
+    def draw(self):
+        screen.blit(self.background, (0, 0))
+        self.widgets.draw(screen)
 
-# функция меню кастомизации
-def customizing():
-    global COINS, set_for_playing, cur
-    sounds[0].stop()
-    sounds[6].play(loops=-1)
-    sounds[6].set_volume(0.2)
-    sound_control()
-    screen.fill(pygame.Color(60, 107, 214))
-    image = pygame.transform.scale(load_image('orig_btn-1.png'), (280, 75))
-    set_1 = pygame.sprite.Sprite(button_sprite)
-    set_1.image = image
-    set_1.rect = set_1.image.get_rect()
-    set_1.rect.x, set_1.rect.y = 10, 50
-    image = pygame.transform.scale(load_image('farm_btn-1.png'), (280, 75))
-    set_2 = pygame.sprite.Sprite(button_sprite)
-    set_2.image = image
-    set_2.rect = set_2.image.get_rect()
-    set_2.rect.x, set_2.rect.y = 10, 200
-    image = pygame.transform.scale(load_image('mar_btn-1.png'), (280, 75))
-    set_3 = pygame.sprite.Sprite(button_sprite)
-    set_3.image = image
-    set_3.rect = set_3.image.get_rect()
-    set_3.rect.x, set_3.rect.y = 10, 350
-    image = pygame.transform.scale(load_image('a_buy_btn.png'), (200, 70))
-    buy = pygame.sprite.Sprite(button_sprite)
-    buy.image = image
-    buy.rect = buy.image.get_rect()
-    buy.rect.x, buy.rect.y = 320, 350
-    image = pygame.transform.scale(load_image('a_choose_btn.png'), (200, 70))
-    choose = pygame.sprite.Sprite(button_sprite)
-    choose.image = image
-    choose.rect = choose.image.get_rect()
-    choose.rect.x, choose.rect.y = 550, 350
-    to_menu = pygame.sprite.Sprite(button_sprite)
-    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-1.png'), (300, 75))
-    to_menu.rect = to_menu.image.get_rect()
-    to_menu.rect.x, to_menu.rect.y = 250, 500
+
+# сцена кастомизации (магазин скинов)
+class ShopScene(Scene):
     sets_list = ['', 'Standard', 'Farmer', 'Mario', 'Sherlock']
-    image = None
-    pushed = 0
-    custom_running = True
-    is_chosen = False
-    while custom_running:
+    # картинки кнопок и превью скинов по номеру в sets_list
+    set_buttons = {1: ('orig_btn-1.png', 'orig_btn-2.png', 'pl_go_anim/goose_pl-2.png'),
+                   2: ('farm_btn-1.png', 'farm_btn-2.png', 'farm_goose/pl_go_anim/goose_pl-2.png'),
+                   3: ('mar_btn-1.png', 'mar_btn-2.png', 'mario_goose/pl_go_anim/goose_pl-2.png')}
+
+    def enter(self):
+        play_music(STORE_MUSIC)
+        self.sets = {}
+        for pushed, images in self.set_buttons.items():
+            self.sets[pushed] = self.widgets.add_button(
+                images[0], None, (10, 50 + 150 * (pushed - 1)), (280, 75),
+                lambda pushed=pushed: self.pick(pushed))
+        self.widgets.add_button('a_buy_btn.png', None, (320, 350), (200, 70), self.buy)
+        self.widgets.add_button('a_choose_btn.png', None, (550, 350), (200, 70), self.choose)
+        self.widgets.add_button('to_menu_btn-1.png', None, (250, 500), (300, 75), self.to_menu)
+        self.chosen_set = None  # картинка выбранного скина, одна на все время сцены
+        self.pushed = 0
+        self.is_chosen = False
+
+    # выбор скина номер pushed из sets_list
+    def pick(self, pushed):
+        for number, button in self.sets.items():
+            image, chosen_image, preview = self.set_buttons[number]
+            self.widgets.set_images(button, chosen_image if number == pushed else image, None,
+                                    (280, 75))
+        preview = self.set_buttons[pushed][2]
+        if self.chosen_set is None:
+            self.chosen_set = self.widgets.add_button(preview, None, (450, 175), (125, 125))
+        else:
+            self.widgets.set_images(self.chosen_set, preview, None, (125, 125))
+        self.is_chosen = True
+        self.pushed = pushed
+        self.invalidate()
+
+    def buy(self):
+        if self.is_chosen and db.buy_set(self.sets_list[self.pushed]):
+            self.invalidate()
+
+    def choose(self):
+        global set_for_playing
+        if self.is_chosen and db.set_bought(self.sets_list[self.pushed]):
+            set_for_playing = self.sets_list[self.pushed]
+
+    def to_menu(self):
+        play_music(MENU_MUSIC)
+        scenes.switch(MenuScene())
+
+    def draw(self):
         screen.fill(pygame.Color(60, 107, 214))
-        text = f'Ваш баланс: {COINS} монет'
-        font = pygame.font.Font(None, 30)
-        text_coord = 10
-        string_render = font.render(text, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        string_rect.top = text_coord
-        string_rect.x = 10
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-        text = 'Цена:'
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = event.pos
-                if set_1.rect.x < x < set_1.rect.x + 300 and \
-                        set_1.rect.y < y < set_1.rect.y + 75:
-                    set_1.image = pygame.transform.scale(load_image('orig_btn-2.png'), (280, 75))
-                    set_2.image = pygame.transform.scale(load_image('farm_btn-1.png'), (280, 75))
-                    set_3.image = pygame.transform.scale(load_image('mar_btn-1.png'), (280, 75))
-                    for sprite in button_sprite:
-                        if sprite.image == image:
-                            sprite.kill()
-                    is_chosen = True
-                    pushed = 1
-                    image = pygame.transform.scale(
-                        load_image('pl_go_anim/goose_pl-2.png'), (125, 125))
-                elif set_2.rect.x < x < set_2.rect.x + 300 and \
-                        set_2.rect.y < y < set_2.rect.y + 75:
-                    set_2.image = pygame.transform.scale(load_image('farm_btn-2.png'), (280, 75))
-                    set_1.image = pygame.transform.scale(load_image('orig_btn-1.png'), (280, 75))
-                    set_3.image = pygame.transform.scale(load_image('mar_btn-1.png'), (280, 75))
-                    for sprite in button_sprite:
-                        if sprite.image == image:
-                            sprite.kill()
-                    is_chosen = True
-                    pushed = 2
-                    image = pygame.transform.scale(
-                        load_image('farm_goose/pl_go_anim/goose_pl-2.png'), (125, 125))
-                elif set_3.rect.x < x < set_3.rect.x + 300 and \
-                        set_3.rect.y < y < set_3.rect.y + 75:
-                    set_1.image = pygame.transform.scale(load_image('orig_btn-1.png'), (280, 75))
-                    set_2.image = pygame.transform.scale(load_image('farm_btn-1.png'), (280, 75))
-                    set_3.image = pygame.transform.scale(load_image('mar_btn-2.png'), (280, 75))
-                    for sprite in button_sprite:
-                        if sprite.image == image:
-                            sprite.kill()
-                    is_chosen = True
-                    pushed = 3
-                    image = pygame.transform.scale(
-                        load_image('mario_goose/pl_go_anim/goose_pl-2.png'), (125, 125))
-                elif buy.rect.x < x < buy.rect.x + 300 and \
-                        buy.rect.y < y < buy.rect.y + 75:
-                    if is_chosen:
-                        result = cur.execute("""Select Is_buyed from Sets Where Name=?""",
-                                             (sets_list[pushed],)).fetchall()
-                        if not int(result[0][0]):
-                            result = cur.execute("""Select Cost from Sets Where Name=?""",
-                                                 (sets_list[pushed],)).fetchall()
-                            if COINS >= int(result[0][0]):
-                                COINS -= int(result[0][0])
-                                cur.execute("""UPDATE Sets 
-                                               SET Is_buyed = 1
-                                               WHERE Name = ?""", (sets_list[pushed],)).fetchall()
-                                cur.execute(f"""UPDATE coins
-                                               SET coins={COINS}""")
-                                con.commit()
-                elif choose.rect.x < x < choose.rect.x + 300 and \
-                        choose.rect.y < y < choose.rect.y + 75:
-                    if is_chosen:
-                        result = cur.execute("""Select Is_buyed from Sets Where Name=?""",
-                                             (sets_list[pushed],)).fetchall()
-                        con.commit()
-                        if result[0][0]:
-                            set_for_playing = sets_list[pushed]
-                elif to_menu.rect.x < x < to_menu.rect.x + 300 and \
-                        to_menu.rect.y < y < to_menu.rect.y + 75:
-                    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-2.png'),
-                                                           (300, 75))
-                    for sprite in button_sprite:
-                        sprite.kill()
-                    sounds[6].stop()
-                    sounds[0].play(loops=-1)
-                    menu()
-        if is_chosen:
-            result = cur.execute("""Select Is_buyed from Sets Where Name=?""",
-                                 (sets_list[pushed],)).fetchall()
-            if not int(result[0][0]):
-                result = cur.execute("""Select Cost from Sets Where Name=?""",
-                                     (sets_list[pushed],)).fetchall()
-                price = int(result[0][0])
-                text = text + ' ' + str(price)
+        draw_lines([f'Ваш баланс: {db.coins} монет'], 30, pygame.Color('green'), 0)
+        if self.is_chosen:
+            name = self.sets_list[self.pushed]
+            if not db.set_bought(name):
+                text = 'Цена: ' + str(db.set_cost(name))
             else:
                 text = 'Куплено'
-            font = pygame.font.Font(None, 30)
-            text_coord = 100
-            string_render = font.render(text, True, pygame.Color('green'))
-            string_rect = string_render.get_rect()
-            string_rect.top = text_coord
-            string_rect.x = 350
-            text_coord += string_rect.height
-            screen.blit(string_render, string_rect)
-            chosen_set = pygame.sprite.Sprite(button_sprite)
-            chosen_set.image = image
-            chosen_set.rect = chosen_set.image.get_rect()
-            chosen_set.rect.x, chosen_set.rect.y = 450, 175
-        button_sprite.draw(screen)
-        pygame.display.flip()
-
-
-# функция описания
-def description():
-    screen.fill(pygame.Color((60, 107, 214)))
-    text = ['Goose game ', 'компьютерная игра в жанре 2D-платформера',
-            'Главный герой - гусь, который проходит',
-            'уровни с множеством препятствий под музыку']
-    background = pygame.transform.scale(load_image('goose1.png', None), (WIDTH, HEIGHT))
-    screen.blit(background, (0, 0))
-    font = pygame.font.Font(None, 30)
-    text_coord = 50
-    for line in text:
-        string_render = font.render(line, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        text_coord += 10
-        string_rect.top = text_coord
-        string_rect.x = 10
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            elif event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
-                menu()
-        pygame.display.flip()
-        clock.tick(FPS)
-
-
-# функция выйгрыша
-def win(coins_count, num, score, level_name):
-    global COINS
-    COINS += coins_count
-    cur.execute(f"""UPDATE coins SET coins={COINS}""")
-    try:
-        res = cur.execute(
-            f'select Points, max_coins from Statistics where level={level_name}').fetchall()
-    except Exception:
-        cur.execute(
-            f'insert or replace into Statistics values("{level_name}", {score}, {coins_count})')
-        con.commit()
-    else:
-        if res[1][0] < coins_count:
-            cur.execute(
-                f'update Statistics set max_coins={coins_count} and points={score} '
-                f'where level={level_name}')
+            draw_lines([text], 30, pygame.Color('green'), 90, 350)
+        self.widgets.draw(screen)
+
+
+# сцена описания
+class DescriptionScene(Scene):
+    def draw(self):
+        text = ['Goose game ', 'компьютерная игра в жанре 2D-платформера',
+                'Главный герой - гусь, который проходит',
+                'уровни с множеством препятствий под музыку']
+        background = image_cache.get('goose1.png', (WIDTH, HEIGHT), None)
+        screen.blit(background, (0, 0))
+        draw_lines(text, 30, pygame.Color('green'))
+
+    def update(self, events, dt):
+        for event in events:
+            if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
+                scenes.switch(MenuScene())
+                return
+
+
+# сцена выйгрыша
+class WinScene(Scene):
+    def __init__(self, coins_count, score, level_name):
+        super().__init__()
+        self.coins_count = coins_count
+        self.score = score
+        self.level_name = level_name
+
+    def enter(self):
+        coins_count, score, level_name = self.coins_count, self.score, self.level_name
+        db.add_coins(coins_count)
+        db.save_result(level_name, score, coins_count)
+        text = ['Поздравляю!', 'Вы прошли уровень!', f'Вы собрали {str(coins_count)} монет',
+                f'Ваш счет: {score}', '', f'Ваш лучший счет: {db.last_score(level_name)}',
+                'Нажмите любую кнопку,', 'чтобы перейти в меню']
+        draw_lines(text, 30, pygame.Color('green'))
+
+    def update(self, events, dt):
+        for event in events:
+            if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
+                clear_level()
+                play_music(MENU_MUSIC, 0)
+                scenes.switch(MenuScene())
+                return
+
+
+# сцена самого уровня(загрузка и основной цикл уровня),
+# при перезапуске передается уже загруженный level, при просмотре записи - playback
+class LevelScene(Scene):
+    fps = RENDER_FPS
+    animated = True
+
+    def __init__(self, level_name, level=None, playback=None):
+        super().__init__()
+        self.level_name = level_name
+        self.level = level
+        self.playback = playback
+
+    def enter(self):
+        level_name = self.level_name
+        play_music(random.choice(LEVEL_MUSIC))
+        db.add_level(level_name)
+        self.best_score = db.last_score(level_name)
+        tile_images['wall'] = image_cache.get(blocks[set_for_playing], (100, 100))
+        if self.level is None:
+            self.level = Level(level_name)
         else:
-            cur.execute(f'update Statistics set points={score} where level={level_name}')
-    con.commit()
-    res = cur.execute(f'select Points from Statistics where level="{level_name}"').fetchall()
-    text = ['Поздравляю!', 'Вы прошли уровень!', f'Вы собрали {str(coins_count)} монет',
-            f'Ваш счет: {score}', '', f'Ваш лучший счет: {str(res[0][0])}',
-            'Нажмите любую кнопку,', 'чтобы перейти в меню']
-    font = pygame.font.Font(None, 30)
-    text_coord = 50
-    for line in text:
-        string_render = font.render(line, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        text_coord += 10
-        string_rect.top = text_coord
-        string_rect.x = 10
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            elif event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
-                sounds[num].stop()
-                for sprite in all_sprites:
-                    sprite.kill()
-                sounds[0].play()
-                menu()
-        all_sprites.draw(screen)
-        pygame.display.flip()
-        clock.tick(FPS)
-
-# функция самого уровня(загрузка и основной цикл уровня)
-def start_level(level_name):
-    sounds[0].stop()
-    num = random.randint(1, 5)
-    sounds[num].play(loops=-1)
-    sounds[num].set_volume(0.1)
-    sound_control()
-    sheet = pygame.sprite.Sprite(all_sprites)
-    sheet.image = load_image('coin.png', -1).subsurface(pygame.Rect(0, 0, 60, 64))
-    sheet.rect = sheet.image.get_rect()
-    sheet.rect.x, sheet.rect.y = 60, 0
-    level_running = True
-    try:
-        res = cur.execute(f'select Points from Statistics where level="{level_name}"').fetchall()
-        best_score = res[0][0]
-    except Exception:
-        cur.execute(
-            f'insert or replace into Statistics values("{level_name}", {0}, {0})')
-        con.commit()
-        res = cur.execute(f'select Points from Statistics where level="{level_name}"').fetchall()
-        best_score = res[0][0]
-    tile_images['wall'] = pygame.transform.scale(load_image(blocks[set_for_playing]), (100, 100))
-    player, level_x, level_y = generate_level(load_level(level_name))
-    camera = Camera((level_x, level_y))
-    while level_running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
+            self.level.reset()
+        self.player_rect = self.level.player.rect
+        self.accumulator = 0
+        # шаги физики, перед которыми сработал прыжок: пишутся в попытке, читаются из записи
+        self.jumps = [] if self.playback is None else set(self.playback.jumps)
+        # положения игрока по шагам для призрака этой попытки и путь призрака лучшей попытки
+        self.positions = array('i', self.player_rect.topleft)
+        self.ghost = None
+        best = db.ghost(level_name) if SHOW_GHOST else None
+        if best is not None:
+            self.ghost = replay.decode_path(best[1])
+            self.ghost_image = get_ghost_image(sets_dict[set_for_playing])
+            self.ghost_rect = self.ghost_image.get_rect(topleft=self.player_rect.topleft)
+
+    def update(self, events, dt):
+        profiler.end_frame(dt)
+        level = self.level
+        player = level.player
+        for event in events:
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 1 and self.playback is None:
+                    if player.jump_p:
+                        self.jumps.append(player.count)
                     player.jump()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                pause()
+                scenes.push(PauseScene())
+                return
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                toggle_trace()
+        # физика идет шагами фиксированной длины, сколько бы ни длился кадр
+        self.accumulator += min(dt, MAX_STEPS_PER_FRAME * STEP_MS)
+        while self.accumulator >= STEP_MS:
+            if self.playback is not None and player.count in self.jumps:
+                player.jump()
+            coins_count = player.coins_count
+            status = step_level(player)
+            self.positions.extend(player.rect.topleft)
+            if status is not None:
+                self.finish(status)
+                return
+            if player.coins_count > coins_count:
+                play_effect('coin.mp3')
+            self.accumulator -= STEP_MS
+        alpha = self.accumulator / STEP_MS if INTERPOLATE else 1
+        self.player_rect = player.lerp_rect(alpha)
+        if self.ghost is not None:
+            self.move_ghost(player.count, alpha)
+        level.camera.update(self.player_rect)
+        if level.stream is not None:
+            level.stream.update(level.camera)
+
+    # попытка закончилась: она сохраняется в replays/, а после просмотра записи - меню
+    def finish(self, status):
+        player = self.level.player
+        if self.playback is not None:
+            print(f'replay {self.level_name}: {status}, steps {player.count}, '
+                  f'score {player.score}')
+            clear_level()
+            play_music(MENU_MUSIC)
+            scenes.switch(MenuScene())
+            return
+        replay.save(replay.Replay(self.level_name, set_for_playing, cheated, self.jumps,
+                                  player.count, status))
+        best = db.ghost(self.level_name)
+        if best is None or player.score > best[0]:
+            db.save_ghost(self.level_name, player.score, replay.encode_path(self.positions))
+        if status == 'win':
+            scenes.switch(WinScene(player.coins_count, player.score, self.level_name))
+        else:
+            scenes.switch(GameOverScene(self.level_name, player.score, player.coins_count,
+                                        self.level))
+
+    # призрак на шаге step лучшего забега, между шагами - как игрок, пока его забег не кончился
+    def move_ghost(self, step, alpha):
+        path = self.ghost
+        if 2 * step + 1 >= len(path):
+            self.ghost_rect = None
+            return
+        prev = max(step - 1, 0)
+        x = path[2 * prev] + (path[2 * step] - path[2 * prev]) * alpha
+        y = path[2 * prev + 1] + (path[2 * step + 1] - path[2 * prev + 1]) * alpha
+        self.ghost_rect = self.ghost_rect.move(round(x) - self.ghost_rect.x,
+                                               round(y) - self.ghost_rect.y)
+
+    def render(self):
         screen.fill(pygame.Color((60, 107, 214)))
-        sheet.rect = sheet.image.get_rect().move(60, 0)
-        camera.update(player)
-        for sprite in all_sprites:
-            camera.apply(sprite)
-        coins.update()
-        player.go(level_name, num)
-        tiles_group.draw(screen)
-        player_group.draw(screen)
-        all_sprites.draw(screen)
-        clock.tick(FPS)
-        font = pygame.font.Font(None, 72)
-        text_coord = 10
-        string_render = font.render(str(player.coins_count), True, pygame.Color('yellow'))
-        string_rect = string_render.get_rect()
-        string_rect.top = text_coord
-        string_rect.x = 10
-        screen.blit(string_render, string_rect)
-        score = player.count // 2 + 100 * player.coins_count
-        player.score = score
-        text = 'Ваши очки: ' + str(score)
-        font = pygame.font.Font(None, 30)
-        text_coord = 10
-        string_render = font.render(text, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        string_rect.top = text_coord
-        string_rect.x = 600
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-        text = 'Ваш последний счет: ' + str(best_score)
-        font = pygame.font.Font(None, 30)
-        text_coord = 10
-        string_render = font.render(text, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        string_rect.top = text_coord
-        string_rect.x = 300
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-        pygame.display.flip()
-
-
-# функция паузы
-def pause():
-    image = pygame.transform.scale(load_image('ad.jpg'), (135, 291))
-    ad = pygame.sprite.Sprite(all_sprites)
-    ad.image = image
-    ad.rect = ad.image.get_rect()
-    ad.rect.x, ad.rect.y = 50, 200
-    text = ['                                           PAUSE',
-            'Шампунь "Жумайсынба" ', 'Скажи перхоти',
-            'Көзіме көрінбейтін бол э, түсіндің ба!']
-    font = pygame.font.Font(None, 30)
-    text_coord = 50
-    string_render = font.render(text[0], True, pygame.Color('blue'))
-    string_rect = string_render.get_rect()
-    text_coord += 10
-    string_rect.top = text_coord
-    string_rect.x = 10
-    text_coord += string_rect.height
-    screen.blit(string_render, string_rect)
-    del text[0]
-    for line in text:
-        string_render = font.render(line, True, pygame.Color('green'))
-        string_rect = string_render.get_rect()
-        text_coord += 10
-        string_rect.top = text_coord
-        string_rect.x = 10
-        text_coord += string_rect.height
-        screen.blit(string_render, string_rect)
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
+        ghost = None
+        if self.ghost is not None and self.ghost_rect is not None:
+            ghost = (self.ghost_image, self.ghost_rect)
+        render_level(self.level.camera, self.level.player, self.player_rect, self.best_score,
+                     BAKED_LAYERS if static_layer.chunks else LEVEL_LAYERS, ghost)
+        if profiler.enabled:
+            profiler_overlay.draw()
+        return None
+
+
+# сцена паузы, лежит поверх уровня
+class PauseScene(Scene):
+    def enter(self):
+        self.image = image_cache.get('ad.jpg', (135, 291))
+        self.ad_rect = self.image.get_rect().move(50, 200)
+        text_coord = draw_lines(['                                           PAUSE'], 30,
+                                pygame.Color('blue'))
+        draw_lines(['Шампунь "Жумайсынба" ', 'Скажи перхоти',
+                    'Көзіме көрінбейтін бол э, түсіндің ба!'], 30, pygame.Color('green'),
+                   text_coord)
+
+    def update(self, events, dt):
+        for event in events:
             if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                ad.kill()
+                scenes.pop()
                 return
-        all_sprites.draw(screen)
-        pygame.display.flip()
 
+    def draw(self):
+        screen.blit(self.image, self.ad_rect)
 
-# функция выбора уровня
-def play():
-    files = os.listdir(path="levels")  # функция для подсчета файлов в папке
+
+# сцена выбора уровня
+class LevelSelectScene(Scene):
     top, right = 50, 100
     w, h = 100, 100
-    image = pygame.transform.scale(load_image('lev_btn-1.png'), (w, h))
-    to_menu = pygame.sprite.Sprite(button_sprite)
-    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-1.png'), (300, 75))
-    to_menu.rect = to_menu.image.get_rect()
-    to_menu.rect.x, to_menu.rect.y = 250, 500
-    for i in range(len(files)):
-        name = i
-        j = i // 5
-        if j > 0:
-            i = i - 5 * j
-        btn = pygame.sprite.Sprite(button_sprite)
-        btn.image = image
-        btn.rect = btn.image.get_rect()
-        btn.rect.x, btn.rect.y = right + i * w + i * 10, top + j * h + j * 10
-    running = True
-    while running:
+
+    def enter(self):
+        files = os.listdir(path="levels")  # функция для подсчета файлов в папке
+        files.append(endless_level_name())  # последняя кнопка - бесконечный забег
+        self.widgets.add_button('to_menu_btn-1.png', 'to_menu_btn-2.png', (250, 500), (300, 75),
+                                lambda: scenes.switch(MenuScene()))
+        # по 5 кнопок в строке
+        for name, level_name in enumerate(files):
+            i, j = name % 5, name // 5
+            label = 'Забег' if level_name.startswith(ENDLESS_PREFIX) else str(name + 1)
+            pos = self.right + i * self.w + i * 10, self.top + j * self.h + j * 10
+            self.widgets.add_button('lev_btn-1.png', 'lev_btn-2.png', pos, (self.w, self.h),
+                                    lambda level_name=level_name: self.start(level_name),
+                                    (35, label, (250, 17, 102)))
+
+    def start(self, level_name):
+        scenes.switch(LevelScene(level_name))
+
+    def draw(self):
         screen.fill((60, 107, 214))
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = event.pos
-                for i in range(len(files)):
-                    name = i
-                    j = i // 5
-                    if j > 0:
-                        i = i - 5 * j
-                    if (right + i * w + i * 10 < x < right + i * w + i * 10 + 100 and
-                            top + j * h + j * 10 < y < top + j * h + j * 10 + 100):
-                        for sprite in button_sprite:
-                            sprite.kill()
-                        start_level(files[name])
-                        terminate()
-                if (to_menu.rect.x < x < to_menu.rect.x + 300 and
-                        to_menu.rect.y < y < to_menu.rect.y + 75):
-                    for sprite in button_sprite:
-                        sprite.kill()
-                    menu()
-            if event.type == pygame.MOUSEMOTION:
-                x, y = event.pos
-                for sprite in button_sprite:
-                    if (sprite.rect.x < x < sprite.rect.x + w and
-                            sprite.rect.y < y < sprite.rect.y + h):
-                        sprite.image = pygame.transform.scale(load_image('lev_btn-2.png'), (w, h))
-                    else:
-                        sprite.image = pygame.transform.scale(load_image('lev_btn-1.png'), (w, h))
-                if (to_menu.rect.x < x < to_menu.rect.x + 300 and
-                        to_menu.rect.y < y < to_menu.rect.y + 75):
-                    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-2.png'),
-                                                           (300, 75))
-                else:
-                    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-1.png'),
-                                                           (300, 75))
-        button_sprite.draw(screen)
-        for i in range(len(files)):
-            name = i
-            j = i // 5
-            if j > 0:
-                i = i - 5 * j
-            font = pygame.font.Font(None, 35)
-            text = font.render(str(name + 1), True, (250, 17, 102))
-            text_w = text.get_width()
-            text_h = text.get_height()
-            text_x = right + i * 100 + i * 10 + w // 2 - text_w // 2
-            text_y = top + j * 100 + j * 1 + h // 2 - text_h // 2
-            screen.blit(text, (text_x, text_y))
-        pygame.display.flip()
-    terminate()
-
-
-# функция проигрыша
-def game_over(level_name, num, score, coins):
-    sounds[num].stop()
-    sounds[-1].play()
-    sounds[-1].set_volume(0.2)
-    sound_control()
-    try:
-        res = cur.execute(
-            f'select Points, max_coins from Statistics where level={level_name}').fetchall()
-    except Exception:
-        cur.execute(f'insert or replace into Statistics values("{level_name}", {score}, {coins})')
-        con.commit()
+        self.widgets.draw(screen)
+
+
+# сцена проигрыша
+class GameOverScene(Scene):
+    def __init__(self, level_name, score, coins, level=None):
+        super().__init__()
+        self.level_name = level_name
+        self.score = score
+        self.coins = coins
+        self.level = level
+
+    def enter(self):
+        level_name, score, coins = self.level_name, self.score, self.coins
+        stop_music()
+        play_effect('hit_in_border.mp3')
+        db.save_result(level_name, score, coins)
+        self.background = image_cache.get('goose4.png', (WIDTH, HEIGHT), None)
+        self.widgets.add_button('res_btn_1.png', 'res_btn_2.png', (480, 50), (300, 70),
+                                lambda: scenes.switch(LevelScene(self.level_name, self.level)))
+        self.widgets.add_button('to_menu_btn-1.png', 'to_menu_btn-2.png', (480, 140), (300, 70),
+                                self.to_menu)
+        self.text = [f'Не расстраивайтесь!', f'Вы на брали {score} очков!']
+
+    def to_menu(self):
+        clear_level()
+        play_music(MENU_MUSIC)
+        scenes.switch(MenuScene())
+
+    def draw(self):
+        screen.blit(self.background, (0, 0))
+        self.widgets.draw(screen)
+        draw_lines(self.text, 30, pygame.Color('green'))
+
+
+scenes = SceneManager()
+
+
+# просмотр записи попытки с теми же скином и чит-режимом, что были при игре
+def replay_scene(path):
+    global set_for_playing, cheated
+    playback = replay.load(path)
+    set_for_playing, cheated = playback.skin, playback.cheated
+    return LevelScene(playback.level_name, playback=playback)
+
+
+# запуск: python main.py или python main.py --replay replays/<запись>.rpl
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--replay':
+        scenes.run(replay_scene(sys.argv[2]))
     else:
-        if res[1][0] < coins:
-            cur.execute(
-                f'update Statistics set max_coins={coins} and points={score} '
-                f'where level={level_name}')
-        else:
-            cur.execute(f'update Statistics set points={score} where level={level_name}')
-    background = pygame.transform.scale(load_image('goose4.png', None), (WIDTH, HEIGHT))
-    screen.blit(background, (0, 0))
-    restart = pygame.sprite.Sprite(button_sprite)
-    restart.image = pygame.transform.scale(load_image('res_btn_1.png'), (300, 70))
-    restart.rect = restart.image.get_rect()
-    restart.rect.x, restart.rect.y = 480, 50
-    to_menu = pygame.sprite.Sprite(button_sprite)
-    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-1.png'), (300, 70))
-    to_menu.rect = to_menu.image.get_rect()
-    to_menu.rect.x, to_menu.rect.y = 480, 140
-    text = [f'Не расстраивайтесь!', f'Вы на брали {score} очков!']
-    for sprite in all_sprites:
-        sprite.kill()
-    game_over_running = True
-    while game_over_running:
-        screen.blit(background, (0, 0))
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                terminate()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    x, y = event.pos
-                    if restart.rect.x < x < restart.rect.x + 300 and\
-                       restart.rect.y < y < restart.rect.y + 70:
-                        for sprite in button_sprite:
-                            sprite.kill()
-                        start_level(level_name)
-                    elif(to_menu.rect.x < x < to_menu.rect.x + 300 and
-                         to_menu.rect.y < y < to_menu.rect.y + 70):
-                        for sprite in button_sprite:
-                            sprite.kill()
-                        sounds[0].play(loops=-1)
-                        sounds[0].set_volume(0.05)
-                        menu()
-            if event.type == pygame.MOUSEMOTION:
-                x, y = event.pos
-                if to_menu.rect.x < x < to_menu.rect.x + 300 and \
-                   to_menu.rect.y < y < to_menu.rect.y + 70:
-                    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-2.png'),
-                                                           (300, 70))
-                else:
-                    to_menu.image = pygame.transform.scale(load_image('to_menu_btn-1.png'),
-                                                           (300, 70))
-                if restart.rect.x < x < restart.rect.x + 300 and \
-                   restart.rect.y < y < restart.rect.y + 70:
-                    restart.image = pygame.transform.scale(load_image('res_btn_2.png'), (300, 70))
-                else:
-                    restart.image = pygame.transform.scale(load_image('res_btn_1.png'), (300, 70))
-            button_sprite.draw(screen)
-            font = pygame.font.Font(None, 30)
-            text_coord = 50
-            for line in text:
-                string_render = font.render(line, True, pygame.Color('green'))
-                string_rect = string_render.get_rect()
-                text_coord += 10
-                string_rect.top = text_coord
-                string_rect.x = 10
-                text_coord += string_rect.height
-                screen.blit(string_render, string_rect)
-            pygame.display.flip()
-
-
-# запуск
-start_screen()
+        scenes.run(StartScene())
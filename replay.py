@@ -0,0 +1,133 @@
+# записи попыток: номера шагов физики, перед которыми сработал прыжок, и все остальное, от чего
+# зависит физика, - уровень, скин и чит-режим; номера хранятся разностями в varint,
+# так что попытка занимает десятки байт
+import os
+import time
+from array import array
+
+REPLAYS_DIR = 'replays'
+MAGIC = b'GRP1'
+OUTCOMES = (None, 'dead', 'win')
+
+
+# класс записи попытки, steps - сколько шагов физики она длилась
+class Replay:
+    def __init__(self, level_name, skin, cheated, jumps=(), steps=0, outcome=None):
+        self.level_name = level_name
+        self.skin = skin
+        self.cheated = cheated
+        self.jumps = list(jumps)
+        self.steps = steps
+        self.outcome = outcome
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+# знаковое число в беззнаковое для varint: 0, -1, 1, -2 ... -> 0, 1, 2, 3 ...
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return -(value >> 1) - 1 if value & 1 else value >> 1
+
+
+def write_string(out, text):
+    raw = text.encode('utf-8')
+    write_varint(out, len(raw))
+    out.extend(raw)
+
+
+def read_string(data, offset):
+    length, offset = read_varint(data, offset)
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+# магия, уровень, скин, флаги (чит-режим и исход), шаги, количество прыжков и их разности
+def encode(replay):
+    out = bytearray(MAGIC)
+    write_string(out, replay.level_name)
+    write_string(out, replay.skin)
+    out.append(int(replay.cheated) | OUTCOMES.index(replay.outcome) << 1)
+    write_varint(out, replay.steps)
+    write_varint(out, len(replay.jumps))
+    previous = 0
+    for step in replay.jumps:
+        write_varint(out, step - previous)
+        previous = step
+    return bytes(out)
+
+
+def decode(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a replay')
+    level_name, offset = read_string(data, len(MAGIC))
+    skin, offset = read_string(data, offset)
+    flags = data[offset]
+    steps, offset = read_varint(data, offset + 1)
+    count, offset = read_varint(data, offset)
+    jumps = []
+    step = 0
+    for _ in range(count):
+        delta, offset = read_varint(data, offset)
+        step += delta
+        jumps.append(step)
+    return Replay(level_name, skin, bool(flags & 1), jumps, steps, OUTCOMES[flags >> 1])
+
+
+# путь призрака: положение игрока до первого шага физики и после каждого шага,
+# points - плоский список x0, y0, x1, y1 ...; хранятся разности с прошлым положением
+def encode_path(points):
+    out = bytearray()
+    previous = [0, 0]
+    for i, value in enumerate(points):
+        write_varint(out, zigzag(value - previous[i & 1]))
+        previous[i & 1] = value
+    return bytes(out)
+
+
+# путь призрака обратно в плоский массив x0, y0, x1, y1 ...
+def decode_path(data):
+    points = array('i')
+    previous = [0, 0]
+    offset = 0
+    while offset < len(data):
+        delta, offset = read_varint(data, offset)
+        value = previous[len(points) & 1] + unzigzag(delta)
+        previous[len(points) & 1] = value
+        points.append(value)
+    return points
+
+
+# сохраняем попытку в replays/<уровень>_<время>.rpl, возвращаем путь
+def save(replay, directory=REPLAYS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    stem = os.path.splitext(replay.level_name)[0]
+    name = (f'{stem}_{time.strftime("%Y%m%d_%H%M%S", time.localtime(now))}_'
+            f'{int(now * 1000) % 1000:03d}.rpl')
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as out:
+        out.write(encode(replay))
+    return path
+
+
+def load(path):
+    with open(path, 'rb') as replay_file:
+        return decode(replay_file.read())
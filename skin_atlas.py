@@ -0,0 +1,97 @@
+# атласы скинов: все кадры анимаций скина одной картинкой и индекс кадров в json
+# исходниками остаются папки data/<скин>/pl_go_anim и pl_jump_anim, а python skin_atlas.py
+# собирает из них compiled_skins/<скин>.png и compiled_skins/<скин>.json
+import os
+import re
+import sys
+import json
+
+import pygame
+
+DATA_DIR = 'data'
+COMPILED_DIR = 'compiled_skins'
+ANIMS = ('pl_go_anim', 'pl_jump_anim')
+FRAME_SIZE = (70, 80)  # как PLAYER_SIZE в main.py
+
+
+# порядок кадров по номерам в именах файлов: goose_pl-2.png раньше goose_pl-10.png
+def frame_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+# файлы кадров анимации anim скина way по порядку
+def frame_names(way, anim):
+    return sorted(os.listdir(os.path.join(DATA_DIR, way + anim)), key=frame_key)
+
+
+# скины, у которых есть папки анимаций: way - префикс пути внутри data, как в sets_dict
+def find_skins():
+    ways = [''] + [name + '/' for name in sorted(os.listdir(DATA_DIR))]
+    return [way for way in ways
+            if all(os.path.isdir(os.path.join(DATA_DIR, way + anim)) for anim in ANIMS)]
+
+
+def atlas_paths(way):
+    name = way.rstrip('/') or 'goose'
+    return (os.path.join(COMPILED_DIR, name + '.png'), os.path.join(COMPILED_DIR, name + '.json'))
+
+
+# время изменения самого нового исходника скина
+def source_mtime(way):
+    return max(os.path.getmtime(os.path.join(DATA_DIR, way + anim, name))
+               for anim in ANIMS for name in frame_names(way, anim))
+
+
+# кадр так же, как его грузит игра: цветовой ключ по левому верхнему пикселю и масштаб size
+def load_frame(path, size):
+    image = pygame.image.load(path).convert()
+    image.set_colorkey(image.get_at((0, 0)))
+    return pygame.transform.scale(image, size)
+
+
+# сборка атласа скина: кадры в ряд, цветовой ключ превращается в прозрачность
+def build_skin(way, size=FRAME_SIZE):
+    png_path, json_path = atlas_paths(way)
+    frames = [(anim, name) for anim in ANIMS for name in frame_names(way, anim)]
+    atlas = pygame.Surface((size[0] * len(frames), size[1]), pygame.SRCALPHA)
+    index = {'frame_size': list(size), 'anims': {anim: [] for anim in ANIMS}}
+    for i, (anim, name) in enumerate(frames):
+        atlas.blit(load_frame(os.path.join(DATA_DIR, way + anim, name), size), (i * size[0], 0))
+        index['anims'][anim].append([i * size[0], 0, size[0], size[1]])
+    pygame.image.save(atlas, png_path)
+    with open(json_path, 'w') as out:
+        json.dump(index, out)
+    return png_path, len(frames)
+
+
+# кадры скина из атласа: {анимация: [картинки]}, None - если атласа нет, он старше
+# исходников или собран под другой размер, тогда кадры грузятся из папок
+def load(way, size):
+    png_path, json_path = atlas_paths(way)
+    if not (os.path.exists(png_path) and os.path.exists(json_path)):
+        return None
+    if min(os.path.getmtime(png_path), os.path.getmtime(json_path)) < source_mtime(way):
+        return None
+    with open(json_path) as index_file:
+        index = json.load(index_file)
+    if tuple(index['frame_size']) != tuple(size):
+        return None
+    atlas = pygame.image.load(png_path).convert_alpha()
+    return {anim: [atlas.subsurface(rect) for rect in rects]
+            for anim, rects in index['anims'].items()}
+
+
+# сборка атласов всех скинов из data/ в compiled_skins/
+def build(ways=None, size=FRAME_SIZE):
+    os.makedirs(COMPILED_DIR, exist_ok=True)
+    for way in ways or find_skins():
+        path, count = build_skin(way, size)
+        print(f'{DATA_DIR}/{way or "."} -> {path} ({count} frames)')
+
+
+if __name__ == '__main__':
+    # окно нужно только для convert(), как при загрузке картинок в игре
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    build([way if way.endswith('/') else way + '/' for way in sys.argv[1:]])
@@ -0,0 +1,137 @@
+# хранилище игры в db.db: таблицы coins, Sets и Statistics целиком читаются в память при запуске,
+# а записи копятся в очереди и пишутся на диск отдельным потоком, пачками в одной транзакции
+import queue
+import sqlite3
+import threading
+from contextlib import closing
+
+# запросы только с параметрами, sqlite3 держит их подготовленными в кэше соединения
+SELECT_COINS = 'SELECT coins FROM coins'
+SELECT_SETS = 'SELECT Name, Cost, Is_buyed FROM Sets'
+SELECT_STATISTICS = 'SELECT level, Points, max_coins FROM Statistics'
+UPDATE_COINS = 'UPDATE coins SET coins = ?'
+UPDATE_SET_BOUGHT = 'UPDATE Sets SET Is_buyed = 1 WHERE Name = ?'
+SAVE_RESULT = 'INSERT OR REPLACE INTO Statistics (level, Points, max_coins) VALUES (?, ?, ?)'
+ADD_LEVEL = 'INSERT OR IGNORE INTO Statistics (level, Points, max_coins) VALUES (?, 0, 0)'
+CREATE_GHOSTS = ('CREATE TABLE IF NOT EXISTS Ghosts (level STRING PRIMARY KEY, '
+                 'score INTEGER NOT NULL, path BLOB NOT NULL)')
+SELECT_GHOST = 'SELECT score, path FROM Ghosts WHERE level = ?'
+SAVE_GHOST = 'INSERT OR REPLACE INTO Ghosts (level, score, path) VALUES (?, ?, ?)'
+
+BATCH = 64  # сколько записей коммитится одной транзакцией
+
+
+# класс хранилища: чтение только из памяти, запись через поток-писатель
+class Storage:
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.writer = None
+        self.reader = None  # соединение для чтения призраков, открывается при первом чтении
+        self.ghosts = {}  # уровень -> (очки, путь) или None, читаются при первом запуске уровня
+        with closing(sqlite3.connect(path)) as con:
+            # WAL: писатель не мешает читать базу, а коммит не переписывает весь файл
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute(CREATE_GHOSTS)
+            con.commit()
+            self.coins = con.execute(SELECT_COINS).fetchone()[0]
+            self.sets = {name: [cost, bool(bought)]
+                         for name, cost, bought in con.execute(SELECT_SETS)}
+            self.statistics = {level: [points, max_coins]
+                               for level, points, max_coins in con.execute(SELECT_STATISTICS)}
+
+    # запись в очередь, поток-писатель запускается при первой записи
+    def write(self, sql, params):
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.run_writer, name='storage-writer',
+                                           daemon=True)
+            self.writer.start()
+        self.queue.put((sql, params))
+
+    # поток-писатель: ждет первую запись, добирает накопившиеся и коммитит их разом
+    def run_writer(self):
+        with closing(sqlite3.connect(self.path)) as con:
+            con.execute('PRAGMA synchronous=NORMAL')
+            running = True
+            while running:
+                batch = [self.queue.get()]
+                while len(batch) < BATCH:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                with con:
+                    for item in batch:
+                        if item is None:
+                            running = False
+                            break
+                        con.execute(*item)
+                for _ in batch:
+                    self.queue.task_done()
+
+    # ждем, пока все записи из очереди окажутся на диске
+    def flush(self):
+        if self.writer is not None:
+            self.queue.join()
+
+    def close(self):
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def add_coins(self, count):
+        self.coins += count
+        self.write(UPDATE_COINS, (self.coins,))
+
+    def set_cost(self, name):
+        return self.sets[name][0]
+
+    def set_bought(self, name):
+        return self.sets[name][1]
+
+    # покупка набора, если хватает монеток, возвращает True, если набор куплен сейчас
+    def buy_set(self, name):
+        cost, bought = self.sets[name]
+        if bought or self.coins < cost:
+            return False
+        self.sets[name][1] = True
+        self.coins -= cost
+        self.write(UPDATE_SET_BOUGHT, (name,))
+        self.write(UPDATE_COINS, (self.coins,))
+        return True
+
+    # строки статистики (уровень, очки, монетки) по порядку уровней
+    def statistics_rows(self):
+        return [(level, points, max_coins)
+                for level, (points, max_coins) in sorted(self.statistics.items())]
+
+    def last_score(self, level):
+        return self.statistics.get(level, (0, 0))[0]
+
+    # уровень появляется в статистике, как только его начали
+    def add_level(self, level):
+        if level not in self.statistics:
+            self.statistics[level] = [0, 0]
+            self.write(ADD_LEVEL, (level,))
+
+    # результат забега: очки - последние, монетки - лучшие
+    def save_result(self, level, score, coins):
+        points, max_coins = self.statistics.get(level, (0, 0))
+        self.statistics[level] = [score, max(max_coins, coins)]
+        self.write(SAVE_RESULT, (level, score, max(max_coins, coins)))
+
+    # лучший забег уровня для призрака: (очки, путь из replay.encode_path) или None
+    def ghost(self, level):
+        if level not in self.ghosts:
+            if self.reader is None:
+                self.reader = sqlite3.connect(self.path)
+            self.ghosts[level] = self.reader.execute(SELECT_GHOST, (level,)).fetchone()
+        return self.ghosts[level]
+
+    def save_ghost(self, level, score, path):
+        self.ghosts[level] = (score, path)
+        self.write(SAVE_GHOST, (level, score, path))
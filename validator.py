@@ -0,0 +1,94 @@
+# проверка уровней на проходимость: перебор моментов прыжка без окна, по процессу на уровень
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+
+CELL = 25  # размер клетки в пикселях, по которым разбрасываются оставленные состояния
+
+
+# поиск по шагам физики: на каждом шаге на земле пробуем прыгнуть и не прыгать,
+# одинаковые состояния склеиваем, а если их больше beam, оставляем beam штук,
+# разбросанных по клеткам уровня, чтобы не потерять ни один из путей
+def validate_level(level_name, beam=256, max_steps=None):
+    import headless  # pygame поднимается уже внутри процесса-воркера
+
+    start = time.perf_counter()
+    sim = headless.Simulation(level_name)
+    if max_steps is None:
+        max_steps = sim.columns * headless.main.tile_width // 5
+    frontier = [(sim.snapshot(), 0)]
+    wins = []  # пары (прыжки, монетки) для всех найденных проходов
+    explored = 0
+    while frontier and sim.steps < max_steps:
+        best = {}
+        for state, jumps in frontier:
+            sim.restore(state)
+            options = (False, True) if sim.player.jump_p else (False,)
+            for jump in options:
+                if jump:
+                    sim.restore(state)
+                status = sim.step(jump)
+                explored += 1
+                if status == 'dead':
+                    continue
+                if status == 'win':
+                    wins.append((jumps + jump, sim.player.coins_count))
+                    continue
+                # из одинаковых состояний оставляем то, где больше монеток, потом меньше прыжков
+                key = sim.key()
+                rank = (-sim.player.coins_count, jumps + jump)
+                if key not in best or rank < best[key][0]:
+                    best[key] = (rank, sim.snapshot(), jumps + jump)
+        cells = {}
+        for rank, state, jumps in sorted(best.values(), key=lambda node: node[0]):
+            cell = (state.rect.x // CELL, state.rect.y // CELL)
+            cells.setdefault(cell, []).append((state, jumps))
+        # берем по очереди лучшее из каждой клетки, потом второе и так далее
+        frontier = [node for row in itertools.zip_longest(*cells.values())
+                    for node in row if node is not None][:beam]
+        if frontier:
+            sim.restore(frontier[0][0])
+    return {'level': level_name,
+            'solvable': bool(wins),
+            'min_jumps': min(jumps for jumps, coins in wins) if wins else None,
+            'max_coins': max(coins for jumps, coins in wins) if wins else None,
+            'states': explored,
+            'seconds': round(time.perf_counter() - start, 2)}
+
+
+def _validate(args):
+    return validate_level(*args)
+
+
+# запуск: python validator.py [уровни] [--beam N] [--workers N] [--json]
+def main():
+    parser = argparse.ArgumentParser(description='Check that levels can be finished.')
+    parser.add_argument('levels', nargs='*', help='level files from levels/ (default: all)')
+    parser.add_argument('--beam', type=int, default=256, help='states kept per physics step')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+    levels = args.levels or sorted(name for name in os.listdir('levels')
+                                   if name.endswith('.txt'))
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(min(args.workers, len(levels)) or 1) as pool:
+        report = pool.map(_validate, [(name, args.beam) for name in levels])
+        # SDL в воркерах перехватывает SIGTERM, поэтому даем им выйти самим
+        pool.close()
+        pool.join()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f'{"level":<16}{"solvable":<10}{"min jumps":<11}{"max coins":<11}{"time, s":<8}')
+        for res in report:
+            print(f'{res["level"]:<16}{str(res["solvable"]):<10}{str(res["min_jumps"]):<11}'
+                  f'{str(res["max_coins"]):<11}{res["seconds"]:<8}')
+    return 0 if all(res['solvable'] for res in report) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())